@@ -2,6 +2,7 @@ import sys
 import json
 import os
 import sqlite3
+import database
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QStackedWidget,
                              QFrame, QLineEdit, QDialog, QDialogButtonBox, 
@@ -480,10 +481,9 @@ class DashboardPage(QWidget):
     
     def get_total_users(self):
         try:
-            connection = sqlite3.connect('user_data.db')
+            connection = database.connect()
             cursor = connection.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users")
-            count = cursor.fetchone()[0]
+            count = database.count_records(cursor)
             connection.close()
             return count
         except Exception as e:
@@ -544,7 +544,8 @@ class DashboardPage(QWidget):
         view_layout.setContentsMargins(0, 0, 0, 0)
         
         # Use the new ViewUserDialog
-        self.user_view = ViewUserDialog()
+        user_key = self.user_data.get('serial_number') if isinstance(self.user_data, dict) else None
+        self.user_view = ViewUserDialog(user_key=user_key)
         
         # Remove dialog buttons if any
         if hasattr(self.user_view, 'button_box'):
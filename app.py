@@ -1,12 +1,43 @@
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, jsonify, request, Response, stream_with_context, make_response, current_app
+from flask.json.provider import JSONProvider
 import sqlite3
-import json
+import csv
+import io
 import os
 from datetime import datetime
-import requests
 import logging
+import threading
+import time
+from contextlib import closing
+from functools import wraps
+import codec
+import database
+import sync_worker
+from database import USER_FIELDS
+
+# jsonify and request.get_json serialize through codec (orjson when installed)
+class CodecJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return codec.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+
+    # Same arguments as jsonify: one value, several values (a list), or keywords
+    # (an object). The body is codec's bytes, without a round trip through str.
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("jsonify() accepts either positional or keyword arguments, not both")
+        if kwargs:
+            obj = kwargs
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or None
+        return current_app.response_class(codec.dumps(obj), mimetype="application/json")
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,112 +50,276 @@ JSON_FILE = os.path.join(BASE_DIR, "view_user.json")
 # Initialize database
 def init_db():
     try:
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                string_serial_number TEXT,
-                report_uniq_id_uid TEXT,
-                device_user_id TEXT,
-                device_reading TEXT,
-                start_date TEXT,
-                end_date TEXT,
-                mask TEXT,
-                mask_type TEXT,
-                start_hour_min TEXT,
-                end_hour_min TEXT,
-                timedifferenceinMinute TEXT,
-                reading_dev_mode TEXT,
-                mode_name TEXT,
-                device_name TEXT,
-                csa_count TEXT,
-                osa_count TEXT,
-                hsa_count TEXT,
-                a_flex TEXT,
-                a_flex_level TEXT,
-                a_flex_value TEXT,
-                leak TEXT,
-                max_pressure TEXT,
-                min_pressure TEXT,
-                pressurechangecount TEXT,
-                ratechangeFactor TEXT,
-                final_date TEXT,
-                date_time TEXT,
-                old_or_new TEXT
-            )
-        """)
-        conn.commit()
-        conn.close()
+        if database.init_db():
+            logger.info("Migrating users table to the typed layout in the background")
         logger.info("Database and users table initialized")
     except sqlite3.Error as e:
         logger.error(f"Error initializing database: {e}")
         raise
 
+# In-memory snapshot of the users table. It is only rebuilt when the data
+# version (bumped by triggers on every insert/update/delete, whoever the
+# writer is) differs from the version the snapshot was built from.
+_snapshot = {"version": None, "users": {}, "count": 0, "body": b"{}", "encoded": {}}
+_snapshot_lock = threading.Lock()
+
+# Records are addressed by rowid everywhere. The typed table's id is an alias of it,
+# and the typed migration keeps each legacy row's rowid as its id, so a record has
+# the same id before and after the migration (a legacy table's own id column may
+# be a UUID, or NULL for rows inserted through the API).
+
+# Convert a users row (without id) to the JSON record layout; `fields` are the
+# selected columns when the row is a projection
+def row_to_user(row, fields=USER_FIELDS):
+    if fields is USER_FIELDS:
+        return dict(zip(USER_FIELDS, database.from_db_values(row)))
+    return {field: database.from_db_value(field, value) for field, value in zip(fields, row)}
+
+# Parse the `fields` query parameter (comma-separated column names) into the
+# columns to select. All of USER_FIELDS when it is absent.
+def parse_fields(args):
+    value = args.get("fields")
+    if value is None:
+        return USER_FIELDS
+    fields = []
+    for field in value.split(","):
+        field = field.strip()
+        if field not in USER_FIELDS:
+            raise ValueError(f"Unknown field '{field}'; fields must be chosen from: {', '.join(USER_FIELDS)}")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+# Read the current data version maintained by the users triggers
+def get_data_version(cursor):
+    cursor.execute("SELECT version FROM data_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+# Last data version read from sqlite, with the stamp of the database files at the
+# time. While neither the database nor its WAL has been written since, the version
+# cannot have changed and is answered without opening a connection.
+_version_cache = {"stamp": None, "version": None}
+# A write within this many seconds of a stamp could share its mtime, so such a
+# stamp is not trusted
+RACY_STAMP_SECONDS = 2
+
+def database_files_stamp():
+    stamp = []
+    for path in (database.DB_PATH, database.DB_PATH + "-wal"):
+        try:
+            info = os.stat(path)
+            stamp.append((info.st_mtime_ns, info.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def current_data_version():
+    global _version_cache
+    stamp = database_files_stamp()
+    cached = _version_cache
+    if stamp == cached["stamp"]:
+        return cached["version"]
+    with database.pooled() as conn:
+        version = get_data_version(conn.cursor())
+    newest_write = max((entry[0] for entry in stamp if entry), default=0) / 1e9
+    trusted = time.time() - newest_write > RACY_STAMP_SECONDS
+    # Replaced whole, so no thread sees one stamp with another version
+    _version_cache = {"stamp": stamp if trusted else None, "version": version}
+    return version
+
+# Conditional GET for read endpoints: the ETag is the data version, so a client
+# that already has the current data gets a bodiless 304 without a query or any
+# serialization. The version is read before the view runs; if a write lands in
+# between, the client just fetches again on its next poll.
+def conditional_get(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = str(current_data_version())
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
+
+# Compress large responses in the coding the client prefers. Streamed exports and
+# already encoded bodies are left alone.
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = codec.negotiate_encoding(request.accept_encodings)
+    if encoding is None or (response.content_length or 0) < codec.MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(codec.compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+# Write the snapshot body to the JSON file without exposing a half-written file
+def write_json_file(body):
+    os.makedirs(BASE_DIR, exist_ok=True)
+    tmp_file = JSON_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(body)
+    os.replace(tmp_file, JSON_FILE)
+
+# Rebuild the snapshot from the database and mirror it to the JSON file
+def rebuild_snapshot(conn):
+    global _snapshot
+    cursor = conn.cursor()
+    # Read the version and the rows in one transaction so they match
+    cursor.execute("BEGIN")
+    try:
+        version = get_data_version(cursor)
+        cursor.execute(f"SELECT rowid, {', '.join(USER_FIELDS)} FROM users WHERE {database.LIVE_SQL}")
+        users = {str(row[0]): row_to_user(row[1:]) for row in cursor}
+    finally:
+        conn.rollback()
+
+    body = codec.dumps(users)
+    try:
+        write_json_file(body)
+    except IOError as e:
+        logger.error(f"File error when writing to {JSON_FILE}: {e}")
+
+    # "encoded" caches the compressed bodies of /api/users/json per content coding
+    _snapshot = {"version": version, "users": users, "count": len(users), "body": body, "encoded": {}}
+    logger.info(f"Snapshot rebuilt with {len(users)} records at data version {version}")
+    return _snapshot
+
+# Return the current snapshot, rebuilding it only if the data has changed
+def get_snapshot(force=False):
+    with database.pooled() as conn:
+        snapshot = _snapshot
+        if not force and snapshot["version"] == get_data_version(conn.cursor()):
+            return snapshot
+        with _snapshot_lock:
+            # Another request may have rebuilt it while we waited for the lock
+            snapshot = _snapshot
+            if not force and snapshot["version"] == get_data_version(conn.cursor()):
+                return snapshot
+            return rebuild_snapshot(conn)
+
+# Filters accepted by the paginated listing, matched exactly in SQL
+FILTER_FIELDS = ["string_serial_number", "device_user_id", "mode_name"]
+# Query parameters that switch GET /api/users to the paginated listing; `fields`
+# alone selects columns from the whole table instead
+LISTING_PARAMS = FILTER_FIELDS + ["limit", "cursor", "start_date_from", "start_date_to"]
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Rows fetched from sqlite per chunk of a streamed export
+EXPORT_BATCH_SIZE = 500
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Convert a DD/MM/YYYY query parameter to YYYY-MM-DD
+def parse_date_param(name, value):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be a date in DD/MM/YYYY format")
+
+# Build the SQL WHERE clause and parameters for the listing filters
+def build_user_filters(args):
+    clauses = [database.LIVE_SQL]
+    params = []
+    for field in FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            clauses.append(f"{field} = ?")
+            params.append(value)
+    if args.get("start_date_from"):
+        clauses.append(f"{database.START_DATE_SQL} >= ?")
+        params.append(parse_date_param("start_date_from", args["start_date_from"]))
+    if args.get("start_date_to"):
+        clauses.append(f"{database.START_DATE_SQL} <= ?")
+        params.append(parse_date_param("start_date_to", args["start_date_to"]))
+    return clauses, params
+
+# Serve one page of users ordered by id, continuing after the `cursor` id
+def list_users(args):
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be a positive integer"}), 400
+    limit = min(limit, MAX_PAGE_LIMIT)
+
+    try:
+        fields = parse_fields(args)
+        clauses, params = build_user_filters(args)
+        if args.get("cursor"):
+            try:
+                clauses.append("rowid > ?")
+                params.append(int(args["cursor"]))
+            except ValueError:
+                raise ValueError("cursor must be an integer id")
+    except ValueError as e:
+        logger.warning(f"Invalid listing parameters: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    where = f"WHERE {' AND '.join(clauses)}"
+    with database.pooled() as conn:
+        cursor = conn.cursor()
+        # Fetch one extra row to know whether another page follows
+        cursor.execute(
+            f"SELECT rowid, {', '.join(fields)} FROM users {where} ORDER BY rowid LIMIT ?",
+            params + [limit + 1]
+        )
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    users = [dict(id=row[0], **row_to_user(row[1:], fields)) for row in rows]
+    next_cursor = rows[-1][0] if has_more else None
+
+    logger.debug(f"Serving page of {len(users)} users, next cursor {next_cursor}")
+    return jsonify({
+        "status": "success",
+        "count": len(users),
+        "data": users,
+        "next_cursor": next_cursor,
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Serve every user like the snapshot does, with only the requested columns read
+def project_users(args):
+    try:
+        fields = parse_fields(args)
+    except ValueError as e:
+        logger.warning(f"Invalid fields parameter: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    with database.pooled() as conn:
+        cursor = conn.execute(f"SELECT rowid, {', '.join(fields)} FROM users WHERE {database.LIVE_SQL}")
+        users = {str(row[0]): row_to_user(row[1:], fields) for row in cursor}
+
+    logger.debug(f"Serving {len(users)} users with fields {', '.join(fields)}")
+    return jsonify({
+        "status": "success",
+        "count": len(users),
+        "data": users,
+        "timestamp": datetime.now().isoformat()
+    })
+
 # Function to update the JSON file
 def update_json_file():
     try:
         logger.debug("Starting update_json_file")
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, string_serial_number, report_uniq_id_uid, device_user_id, device_reading,
-                   start_date, end_date, mask, mask_type, start_hour_min, end_hour_min,
-                   timedifferenceinMinute, reading_dev_mode, mode_name, device_name,
-                   csa_count, osa_count, hsa_count, a_flex, a_flex_level, a_flex_value,
-                   leak, max_pressure, min_pressure, pressurechangecount, ratechangeFactor,
-                   final_date, date_time, old_or_new
-            FROM users
-        """)
-        rows = cursor.fetchall()
-        
-        users = {}
-        for row in rows:
-            users[str(row[0])] = {
-                "string_serial_number": row[1] if row[1] is not None else "",
-                "report_uniq_id_uid": row[2] if row[2] is not None else "",
-                "device_user_id": row[3] if row[3] is not None else "",
-                "device_reading": row[4] if row[4] is not None else "",
-                "start_date": row[5] if row[5] is not None else "",
-                "end_date": row[6] if row[6] is not None else "",
-                "mask": row[7] if row[7] is not None else "",
-                "mask_type": row[8] if row[8] is not None else "",
-                "start_hour_min": row[9] if row[9] is not None else "",
-                "end_hour_min": row[10] if row[10] is not None else "",
-                "timedifferenceinMinute": row[11] if row[11] is not None else "",
-                "reading_dev_mode": row[12] if row[12] is not None else "",
-                "mode_name": row[13] if row[13] is not None else "",
-                "device_name": row[14] if row[14] is not None else "",
-                "csa_count": row[15] if row[15] is not None else "",
-                "osa_count": row[16] if row[16] is not None else "",
-                "hsa_count": row[17] if row[17] is not None else "",
-                "a_flex": row[18] if row[18] is not None else "",
-                "a_flex_level": row[19] if row[19] is not None else "",
-                "a_flex_value": row[20] if row[20] is not None else "",
-                "leak": row[21] if row[21] is not None else "",
-                "max_pressure": row[22] if row[22] is not None else "",
-                "min_pressure": row[23] if row[23] is not None else "",
-                "pressurechangecount": row[24] if row[24] is not None else "",
-                "ratechangeFactor": row[25] if row[25] is not None else "",
-                "final_date": row[26] if row[26] is not None else "",
-                "date_time": row[27] if row[27] is not None else "",
-                "old_or_new": row[28] if row[28] is not None else ""
-            }
-        
-        os.makedirs(BASE_DIR, exist_ok=True)
-        with open(JSON_FILE, "w", encoding='utf-8') as f:
-            json.dump(users, f, indent=4, ensure_ascii=False)
-        
-        conn.close()
-        logger.info(f"JSON file updated with {len(users)} records at {JSON_FILE}")
-        return len(users)
+        snapshot = get_snapshot(force=True)
+        logger.info(f"JSON file updated with {snapshot['count']} records at {JSON_FILE}")
+        return snapshot["count"]
     except sqlite3.Error as e:
         logger.error(f"Database error in update_json_file: {e}")
         return 0
-    except IOError as e:
-        logger.error(f"File error when writing to {JSON_FILE}: {e}")
-        return 0
     except Exception as e:
         logger.error(f"General error in update_json_file: {e}")
         return 0
@@ -147,65 +342,157 @@ def manual_update_json():
 # Default home route
 @app.route('/')
 def home():
-    return "Welcome! Use /api/users to fetch data, /api/send to forward JSON, /api/users (POST) to add data, /api/users/<id> (PUT) to update data, or /api/update_json to manually update JSON."
+    return "Welcome! Use /api/users to fetch data (add ?limit=&cursor= to page through it), /api/send to forward JSON, /api/users (POST) to add data, /api/users/<id> (PUT) to update data, or /api/update_json to manually update JSON."
 
 # API endpoint to get user data
 @app.route('/api/users', methods=['GET'])
+@conditional_get
 def get_users():
     try:
-        count = update_json_file()
-        with open(JSON_FILE, "r", encoding='utf-8') as f:
-            users = json.load(f)
-        
-        logger.debug(f"Serving {count} users from JSON")
+        if any(param in request.args for param in LISTING_PARAMS):
+            return list_users(request.args)
+        if "fields" in request.args:
+            return project_users(request.args)
+
+        snapshot = get_snapshot()
+        logger.debug(f"Serving {snapshot['count']} users from snapshot version {snapshot['version']}")
         return jsonify({
             "status": "success",
-            "count": count,
-            "data": users,
+            "count": snapshot["count"],
+            "data": snapshot["users"],
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
         logger.error(f"Error in get_users: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Stream users straight from the sqlite cursor, one batch of rows per chunk
+def generate_export(export_format, clauses, params):
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # Close the cursor before the connection goes back to the pool, even when
+    # the client disconnects mid-stream
+    with database.pooled() as conn, closing(conn.cursor()) as cursor:
+        cursor.execute(f"SELECT rowid, {', '.join(USER_FIELDS)} FROM users {where} ORDER BY rowid", params)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+        if writer:
+            writer.writerow(["id"] + USER_FIELDS)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if writer:
+                    writer.writerow([row[0]] + database.from_db_values(row[1:]))
+                else:
+                    buffer.write(codec.dumps(dict(id=row[0], **row_to_user(row[1:]))).decode("utf-8"))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # An empty CSV export still carries its header row
+        if buffer.tell():
+            yield buffer.getvalue()
+
+# API endpoint to export users as NDJSON (default) or CSV with chunked transfer
+@app.route('/api/users/export', methods=['GET'])
+@conditional_get
+def export_users():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({"status": "error", "message": "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        clauses, params = build_user_filters(request.args)
+    except ValueError as e:
+        logger.warning(f"Invalid export parameters: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    logger.debug(f"Streaming {export_format} export")
+    return Response(
+        stream_with_context(generate_export(export_format, clauses, params)),
+        mimetype=EXPORT_MIMETYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=users.{export_format}"}
+    )
+
 # API endpoint to directly serve the JSON file
 @app.route('/api/users/json', methods=['GET'])
+@conditional_get
 def get_users_json():
     try:
-        update_json_file()
-        logger.debug(f"Serving JSON file from {JSON_FILE}")
-        return send_file(JSON_FILE, mimetype='application/json')
+        snapshot = get_snapshot()
+        logger.debug(f"Serving JSON snapshot version {snapshot['version']}")
+        body = snapshot["body"]
+        encoding = codec.negotiate_encoding(request.accept_encodings)
+        if encoding is None or len(body) < codec.MIN_COMPRESS_SIZE:
+            return Response(body, mimetype='application/json')
+        # Compressed once per snapshot and coding, then reused until the data changes
+        encoded = snapshot["encoded"].get(encoding)
+        if encoded is None:
+            encoded = snapshot["encoded"][encoding] = codec.compress(body, encoding)
+        response = Response(encoded, mimetype='application/json')
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
     except Exception as e:
         logger.error(f"Error in get_users_json: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# API endpoint to get user count
+# API endpoint to get user count, read from the counters the users triggers keep.
+# string_serial_number or mode_name count one device or CPAP type;
+# by=device or by=mode adds the count of every device or CPAP type.
 @app.route('/api/users/count', methods=['GET'])
+@conditional_get
 def get_user_count():
     try:
-        count = update_json_file()
+        by = request.args.get("by")
+        if by is not None and by not in database.COUNT_SCOPES:
+            return jsonify({"status": "error", "message": "by must be 'device' or 'mode'"}), 400
+
+        # Counts are kept per device and per CPAP type, not per combination
+        scopes = [(name, request.args[column]) for name, column in database.COUNT_SCOPES.items()
+                  if request.args.get(column)]
+        if len(scopes) > 1:
+            return jsonify({
+                "status": "error",
+                "message": "Give at most one of string_serial_number and mode_name"
+            }), 400
+        scope, key = scopes[0] if scopes else ("total", "")
+        with database.pooled() as conn:
+            cursor = conn.cursor()
+            count = database.count_records(cursor, scope, key)
+            result = {
+                "status": "success",
+                "count": count,
+                "timestamp": datetime.now().isoformat()
+            }
+            if by:
+                result[f"by_{by}"] = database.record_count_breakdown(cursor, by)
         logger.debug(f"User count: {count}")
-        return jsonify({
-            "status": "success",
-            "count": count,
-            "timestamp": datetime.now().isoformat()
-        })
+        return jsonify(result)
     except Exception as e:
         logger.error(f"Error in get_user_count: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # API endpoint to get single user by ID
 @app.route('/api/users/<int:user_id>', methods=['GET'])
+@conditional_get
 def get_user_by_id(user_id):
     try:
-        update_json_file()
-        with open(JSON_FILE, "r", encoding='utf-8') as f:
-            users = json.load(f)
-        
-        user = users.get(str(user_id))
-        if user:
+        try:
+            fields = parse_fields(request.args)
+        except ValueError as e:
+            logger.warning(f"Invalid fields parameter: {str(e)}")
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        # One primary-key lookup, reading only the requested columns
+        with database.pooled() as conn:
+            cursor = conn.execute(
+                f"SELECT {', '.join(fields)} FROM users WHERE rowid = ? AND {database.LIVE_SQL}", (user_id,)
+            )
+            row = cursor.fetchone()
+        if row:
             logger.debug(f"Found user {user_id}")
-            return jsonify({"status": "success", "user_id": user_id, "data": user})
+            return jsonify({"status": "success", "user_id": user_id, "data": row_to_user(row, fields)})
         else:
             logger.warning(f"User {user_id} not found")
             return jsonify({"status": "error", "message": f"User {user_id} not found"}), 404
@@ -213,6 +500,175 @@ def get_user_by_id(user_id):
         logger.error(f"Error in get_user_by_id: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Most ids or report UIDs one batch_get request may ask for
+MAX_BATCH_GET = 1000
+
+# Read the lookup keys of a batch_get body: {"ids": [...]} or {"report_uids": [...]}.
+# Returns the key name and its values without duplicates, in request order.
+def parse_batch_keys(data):
+    if ("ids" in data) == ("report_uids" in data):
+        raise ValueError("Provide either 'ids' or 'report_uids'")
+    key = "ids" if "ids" in data else "report_uids"
+    values = data[key]
+    if not isinstance(values, list):
+        raise ValueError(f"'{key}' must be a list")
+    if len(values) > MAX_BATCH_GET:
+        raise ValueError(f"At most {MAX_BATCH_GET} {key} per request")
+    if key == "ids":
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            raise ValueError("ids must be integers")
+    else:
+        if not all(isinstance(value, (str, int)) and not isinstance(value, bool) for value in values):
+            raise ValueError("report_uids must be strings")
+        values = [str(value) for value in values]
+    return key, list(dict.fromkeys(values))
+
+# API endpoint to fetch many users in one request, by id or by report UID
+# (optionally limited to one device with "string_serial_number"). Each chunk of
+# keys is one IN query; keys that matched nothing are listed in "missing".
+@app.route('/api/users/batch_get', methods=['POST'])
+def batch_get_users():
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                "status": "error",
+                "message": "Request body must be a JSON object with 'ids' or 'report_uids'"
+            }), 400
+        try:
+            fields = parse_fields(request.args)
+            key, values = parse_batch_keys(data)
+        except ValueError as e:
+            logger.warning(f"Invalid batch_get request: {str(e)}")
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        column = "rowid" if key == "ids" else "report_uniq_id_uid"
+        serial_number = data.get("string_serial_number") if key == "report_uids" else None
+        users = {}
+        matched = set()
+        with database.pooled() as conn:
+            for chunk in database.id_chunks(values):
+                sql = (
+                    f"SELECT rowid, report_uniq_id_uid, {', '.join(fields)} FROM users "
+                    f"WHERE {column} IN ({', '.join('?' for _ in chunk)}) AND {database.LIVE_SQL}"
+                )
+                params = list(chunk)
+                if serial_number:
+                    sql += " AND string_serial_number = ?"
+                    params.append(serial_number)
+                for row in conn.execute(sql, params):
+                    users[str(row[0])] = row_to_user(row[2:], fields)
+                    matched.add(row[0] if key == "ids" else row[1])
+        missing = [value for value in values if value not in matched]
+
+        logger.debug(f"batch_get matched {len(users)} users for {len(values)} {key}")
+        return jsonify({
+            "status": "success",
+            "count": len(users),
+            "data": users,
+            "missing": missing
+        })
+    except Exception as e:
+        logger.error(f"Error in batch_get_users: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Fields stored as numbers. They may be sent as numbers or numeric strings ("24",
+# not "24 L/min"); every other field must be a string.
+NUMERIC_FIELDS = database.NUMERIC_FIELDS
+REQUIRED_FIELDS = ['start_date']
+
+INSERT_USER_SQL = f"""
+    INSERT INTO users ({', '.join(USER_FIELDS)})
+    VALUES ({', '.join('?' for _ in USER_FIELDS)})
+"""
+UPDATE_USER_SQL = f"""
+    UPDATE users
+    SET {', '.join(f'{field} = ?' for field in USER_FIELDS)}
+    WHERE rowid = ?
+"""
+
+# Re-uploads of a report (same device serial and report UID) are matched
+# through idx_users_report_uid instead of being stored again; re-uploading a
+# deleted report restores it
+SERIAL_INDEX = USER_FIELDS.index("string_serial_number")
+REPORT_UID_INDEX = USER_FIELDS.index("report_uniq_id_uid")
+FIND_REPORT_SQL = """
+    SELECT rowid FROM users
+    WHERE string_serial_number = ? AND report_uniq_id_uid = ? AND report_uniq_id_uid <> ''
+"""
+UPSERT_USER_SQL = INSERT_USER_SQL + f"""
+    ON CONFLICT (string_serial_number, report_uniq_id_uid) WHERE report_uniq_id_uid <> ''
+    DO UPDATE SET {', '.join(f'{field} = excluded.{field}' for field in USER_FIELDS)}, deleted_at = NULL
+"""
+# Only touches the row when at least one field differs from the stored values,
+# or the record was deleted
+UPDATE_CHANGED_SQL = f"""
+    UPDATE users
+    SET {', '.join(f'{field} = ?' for field in USER_FIELDS)}, deleted_at = NULL
+    WHERE rowid = ? AND NOT ({' AND '.join(f'{field} IS ?' for field in USER_FIELDS)} AND {database.LIVE_SQL})
+"""
+
+# Largest number of records accepted by one bulk request
+BULK_MAX_RECORDS = 50000
+
+# Validate an incoming user record, returning an error message or None
+def validate_user_data(data):
+    if not isinstance(data, dict):
+        return "Record must be a JSON object"
+
+    missing_fields = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing_fields:
+        return f"Missing required fields: {missing_fields}"
+
+    for field in USER_FIELDS:
+        value = data.get(field)
+        if not value:
+            continue
+        if field in NUMERIC_FIELDS:
+            if not isinstance(value, (str, int, float)):
+                return f"{field} must be a string or number"
+            try:
+                database.parse_number(field, value)
+            except ValueError as e:
+                return str(e)
+        elif not isinstance(value, str):
+            return f"{field} must be a string"
+    return None
+
+# Stored column values of a validated record, in USER_FIELDS order
+def user_values(data):
+    return database.to_db_values(data)
+
+# Store rows of user values, inserting new reports and updating re-uploaded ones.
+# Returns one {"status", "user_id"} result per row, where status is "inserted",
+# "updated" or "skipped" (re-upload identical to the stored record).
+def upsert_users(conn, rows):
+    cursor = conn.cursor()
+    results = []
+    for values in rows:
+        key = (values[SERIAL_INDEX], values[REPORT_UID_INDEX])
+        user_id = None
+        if values[REPORT_UID_INDEX]:
+            cursor.execute(FIND_REPORT_SQL, key)
+            row = cursor.fetchone()
+            user_id = row[0] if row else None
+
+        if user_id is None:
+            # Inserted one at a time so every record's id is known; the statement
+            # is prepared once and the rows share the caller's transaction
+            cursor.execute(UPSERT_USER_SQL, values)
+            user_id = cursor.lastrowid
+            if values[REPORT_UID_INDEX]:
+                # lastrowid is stale if a concurrent upload of the report won the
+                # race and the insert became an update
+                cursor.execute(FIND_REPORT_SQL, key)
+                user_id = cursor.fetchone()[0]
+            results.append({"status": "inserted", "user_id": user_id})
+        else:
+            cursor.execute(UPDATE_CHANGED_SQL, values + (user_id,) + values)
+            results.append({"status": "updated" if cursor.rowcount else "skipped", "user_id": user_id})
+    return results
+
 # Endpoint to add a new user
 @app.route('/api/users', methods=['POST'])
 def add_user():
@@ -230,93 +686,109 @@ def add_user():
             logger.warning("No input data provided or invalid JSON")
             return jsonify({"status": "error", "message": "No input data provided or invalid JSON"}), 400
 
-        required_fields = ['start_date']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            logger.warning(f"Missing required fields: {missing_fields}")
-            return jsonify({"status": "error", "message": f"Missing required fields: {missing_fields}"}), 400
+        error = validate_user_data(data)
+        if error:
+            logger.warning(f"Invalid user data: {error}")
+            return jsonify({"status": "error", "message": error}), 400
 
-        # Validate data types
         try:
-            for field in ['timedifferenceinMinute', 'csa_count', 'osa_count', 'hsa_count', 'a_flex_level', 
-                         'a_flex_value', 'leak', 'max_pressure', 'min_pressure', 'pressurechangecount', 
-                         'ratechangeFactor']:
-                if field in data and data[field] and not isinstance(data[field], (str, int, float)):
-                    raise ValueError(f"{field} must be a string or number")
-            for field in ['string_serial_number', 'report_uniq_id_uid', 'device_user_id', 'device_reading',
-                         'start_date', 'end_date', 'mask', 'mask_type', 'start_hour_min', 'end_hour_min',
-                         'reading_dev_mode', 'mode_name', 'device_name', 'a_flex', 'final_date', 'date_time',
-                         'old_or_new']:
-                if field in data and data[field] and not isinstance(data[field], str):
-                    raise ValueError(f"{field} must be a string")
+            with database.pooled() as conn:
+                result = upsert_users(conn, [user_values(data)])[0]
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Database error during insertion: {e}")
+            return jsonify({"status": "error", "message": f"Database error: {e}"}), 500
+
+        user_id = result["user_id"]
+        messages = {
+            "inserted": f"User {user_id} added successfully",
+            "updated": f"User {user_id} updated from re-uploaded report",
+            "skipped": f"User {user_id} already up to date"
+        }
+        logger.debug(f"User {user_id} {result['status']} in database")
+        return jsonify({
+            "status": "success",
+            "message": messages[result["status"]],
+            "user_id": user_id,
+            "result": result["status"]
+        }), 201 if result["status"] == "inserted" else 200
+
+    except Exception as e:
+        logger.error(f"Unexpected error in add_user: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Read the records of a bulk request: a JSON array, or one JSON object per NDJSON line.
+# Lines that are not valid JSON are returned as exceptions so they can be reported per record.
+def read_bulk_records():
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(codec.loads(line))
+            except ValueError as e:
+                records.append(ValueError(f"Invalid JSON: {e}"))
+        return records
+
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise ValueError("Request body must be a JSON array of records")
+    return records
+
+# Endpoint to add many users in one transaction
+@app.route('/api/users/bulk', methods=['POST'])
+def add_users_bulk():
+    try:
+        if request.mimetype not in ('application/json', 'application/x-ndjson'):
+            logger.warning(f"Invalid or missing Content-Type: {request.content_type}")
+            return jsonify({
+                "status": "error",
+                "message": "Content-Type must be application/json or application/x-ndjson"
+            }), 415
+
+        try:
+            records = read_bulk_records()
         except ValueError as e:
-            logger.warning(f"Invalid data type: {str(e)}")
+            logger.warning(f"Invalid bulk payload: {str(e)}")
             return jsonify({"status": "error", "message": str(e)}), 400
 
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
+        if len(records) > BULK_MAX_RECORDS:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {BULK_MAX_RECORDS} records are accepted per request"
+            }), 413
+
+        results = []
+        rows = []
+        for index, record in enumerate(records):
+            error = str(record) if isinstance(record, Exception) else validate_user_data(record)
+            if error:
+                results.append({"index": index, "status": "error", "message": error})
+            else:
+                results.append({"index": index})
+                rows.append(user_values(record))
 
         try:
-            cursor.execute("""
-                INSERT INTO users (
-                    string_serial_number, report_uniq_id_uid, device_user_id, device_reading,
-                    start_date, end_date, mask, mask_type, start_hour_min, end_hour_min,
-                    timedifferenceinMinute, reading_dev_mode, mode_name, device_name,
-                    csa_count, osa_count, hsa_count, a_flex, a_flex_level, a_flex_value,
-                    leak, max_pressure, min_pressure, pressurechangecount, ratechangeFactor,
-                    final_date, date_time, old_or_new
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data.get('string_serial_number', ''),
-                data.get('report_uniq_id_uid', ''),
-                data.get('device_user_id', ''),
-                data.get('device_reading', ''),
-                data.get('start_date', ''),
-                data.get('end_date', ''),
-                data.get('mask', ''),
-                data.get('mask_type', ''),
-                data.get('start_hour_min', ''),
-                data.get('end_hour_min', ''),
-                data.get('timedifferenceinMinute', ''),
-                data.get('reading_dev_mode', ''),
-                data.get('mode_name', ''),
-                data.get('device_name', ''),
-                data.get('csa_count', ''),
-                data.get('osa_count', ''),
-                data.get('hsa_count', ''),
-                data.get('a_flex', ''),
-                data.get('a_flex_level', ''),
-                data.get('a_flex_value', ''),
-                data.get('leak', ''),
-                data.get('max_pressure', ''),
-                data.get('min_pressure', ''),
-                data.get('pressurechangecount', ''),
-                data.get('ratechangeFactor', ''),
-                data.get('final_date', ''),
-                data.get('date_time', ''),
-                data.get('old_or_new', '')
-            ))
-            conn.commit()
+            with database.pooled() as conn, conn:
+                stored = iter(upsert_users(conn, rows))
         except sqlite3.Error as e:
-            conn.close()
-            logger.error(f"Database error during insertion: {e}")
+            logger.error(f"Database error during bulk insertion: {e}")
             return jsonify({"status": "error", "message": f"Database error: {e}"}), 500
-        finally:
-            conn.close()
-
-        user_id = cursor.lastrowid
-        logger.debug(f"Added user {user_id} to database")
 
-        count = update_json_file()
-        logger.debug(f"JSON updated after adding user {user_id} with {count} records")
-        return jsonify({
-            "status": "success",
-            "message": f"User {user_id} added successfully",
-            "user_id": user_id
-        }), 201
+        counts = {"inserted": 0, "updated": 0, "skipped": 0, "failed": len(records) - len(rows)}
+        for result in results:
+            if "status" not in result:
+                result.update(next(stored))
+                counts[result["status"]] += 1
+        logger.debug(f"Bulk ingest: {counts}")
+        if not rows:
+            return jsonify(dict(status="error", message="No valid records", results=results, **counts)), 400
+        return jsonify(dict(status="success", results=results, **counts))
 
     except Exception as e:
-        logger.error(f"Unexpected error in add_user: {str(e)}")
+        logger.error(f"Unexpected error in add_users_bulk: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # Endpoint to update an existing user
@@ -336,92 +808,41 @@ def update_user(user_id):
             logger.warning("No input data provided or invalid JSON")
             return jsonify({"status": "error", "message": "No input data provided or invalid JSON"}), 400
 
-        required_fields = ['start_date']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            logger.warning(f"Missing required fields: {missing_fields}")
-            return jsonify({"status": "error", "message": f"Missing required fields: {missing_fields}"}), 400
+        error = validate_user_data(data)
+        if error:
+            logger.warning(f"Invalid user data: {error}")
+            return jsonify({"status": "error", "message": error}), 400
 
-        # Validate data types
         try:
-            for field in ['timedifferenceinMinute', 'csa_count', 'osa_count', 'hsa_count', 'a_flex_level', 
-                         'a_flex_value', 'leak', 'max_pressure', 'min_pressure', 'pressurechangecount', 
-                         'ratechangeFactor']:
-                if field in data and data[field] and not isinstance(data[field], (str, int, float)):
-                    raise ValueError(f"{field} must be a string or number")
-            for field in ['string_serial_number', 'report_uniq_id_uid', 'device_user_id', 'device_reading',
-                         'start_date', 'end_date', 'mask', 'mask_type', 'start_hour_min', 'end_hour_min',
-                         'reading_dev_mode', 'mode_name', 'device_name', 'a_flex', 'final_date', 'date_time',
-                         'old_or_new']:
-                if field in data and data[field] and not isinstance(data[field], str):
-                    raise ValueError(f"{field} must be a string")
-        except ValueError as e:
-            logger.warning(f"Invalid data type: {str(e)}")
-            return jsonify({"status": "error", "message": str(e)}), 400
-
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-            if not cursor.fetchone():
-                conn.close()
-                logger.warning(f"User {user_id} not found")
-                return jsonify({"status": "error", "message": f"User {user_id} not found"}), 404
-
-            cursor.execute("""
-                UPDATE users
-                SET string_serial_number = ?, report_uniq_id_uid = ?, device_user_id = ?,
-                    device_reading = ?, start_date = ?, end_date = ?, mask = ?, mask_type = ?,
-                    start_hour_min = ?, end_hour_min = ?, timedifferenceinMinute = ?,
-                    reading_dev_mode = ?, mode_name = ?, device_name = ?, csa_count = ?,
-                    osa_count = ?, hsa_count = ?, a_flex = ?, a_flex_level = ?, a_flex_value = ?,
-                    leak = ?, max_pressure = ?, min_pressure = ?, pressurechangecount = ?,
-                    ratechangeFactor = ?, final_date = ?, date_time = ?, old_or_new = ?
-                WHERE id = ?
-            """, (
-                data.get('string_serial_number', ''),
-                data.get('report_uniq_id_uid', ''),
-                data.get('device_user_id', ''),
-                data.get('device_reading', ''),
-                data.get('start_date', ''),
-                data.get('end_date', ''),
-                data.get('mask', ''),
-                data.get('mask_type', ''),
-                data.get('start_hour_min', ''),
-                data.get('end_hour_min', ''),
-                data.get('timedifferenceinMinute', ''),
-                data.get('reading_dev_mode', ''),
-                data.get('mode_name', ''),
-                data.get('device_name', ''),
-                data.get('csa_count', ''),
-                data.get('osa_count', ''),
-                data.get('hsa_count', ''),
-                data.get('a_flex', ''),
-                data.get('a_flex_level', ''),
-                data.get('a_flex_value', ''),
-                data.get('leak', ''),
-                data.get('max_pressure', ''),
-                data.get('min_pressure', ''),
-                data.get('pressurechangecount', ''),
-                data.get('ratechangeFactor', ''),
-                data.get('final_date', ''),
-                data.get('date_time', ''),
-                data.get('old_or_new', ''),
-                user_id
-            ))
-            conn.commit()
+            with database.pooled() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT rowid FROM users WHERE rowid = ? AND {database.LIVE_SQL}", (user_id,))
+                if not cursor.fetchone():
+                    logger.warning(f"User {user_id} not found")
+                    return jsonify({"status": "error", "message": f"User {user_id} not found"}), 404
+
+                values = user_values(data)
+                try:
+                    cursor.execute(UPDATE_USER_SQL, values + (user_id,))
+                except sqlite3.IntegrityError:
+                    # Another record already holds this device's report UID
+                    conn.rollback()
+                    cursor.execute(FIND_REPORT_SQL, (values[SERIAL_INDEX], values[REPORT_UID_INDEX]))
+                    row = cursor.fetchone()
+                    conflict_id = row[0] if row else None
+                    logger.warning(f"Update of user {user_id} conflicts with user {conflict_id}")
+                    return jsonify({
+                        "status": "error",
+                        "message": f"Report {values[REPORT_UID_INDEX]} of device {values[SERIAL_INDEX]} "
+                                   f"is already stored as user {conflict_id}",
+                        "conflict_id": conflict_id
+                    }), 409
+                conn.commit()
         except sqlite3.Error as e:
-            conn.close()
             logger.error(f"Database error during update: {e}")
             return jsonify({"status": "error", "message": f"Database error: {e}"}), 500
-        finally:
-            conn.close()
 
         logger.debug(f"Updated user {user_id} in database")
-        
-        update_json_file()
-        logger.debug(f"JSON updated after updating user {user_id}")
         return jsonify({
             "status": "success",
             "message": f"User {user_id} updated successfully",
@@ -432,54 +853,52 @@ def update_user(user_id):
         logger.error(f"Unexpected error in update_user: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# API endpoint to send JSON to external API
+# API endpoint to send the records to the external API. Records changed since the
+# last acknowledged send (all records with ?full=1, and always for the production
+# endpoint, which takes the full record set) are queued in the sync outbox and sent
+# by the background worker; poll the returned job.
 @app.route('/api/send', methods=['GET', 'POST'])
 def send_data_to_external():
     try:
-        with open(JSON_FILE, "r", encoding='utf-8') as f:
-            payload = json.load(f)
-
-        logger.debug("Payload BEFORE sending:")
-        logger.debug(json.dumps(payload, indent=4))
-
-        url = "https://deckmount.in/api/web/tanya.php?user_id=1"
-        response = requests.post(url, data={"data": json.dumps(payload)})
-
-        logger.debug(f"External API status code: {response.status_code}")
-        logger.debug("External API raw response:")
-        logger.debug(response.text)
-
-        try:
-            external_json = response.json()
-        except Exception:
-            external_json = {"raw": response.text}
-
+        job = sync_worker.enqueue_sync(full=request.args.get("full") == "1")
+        sync_worker.worker.start()
         return jsonify({
             "status": "success",
-            "external_status": response.status_code,
-            "external_response": external_json,
-            "records_sent": len(payload)
-        })
+            "job_id": job["id"],
+            "job": job
+        }), 202
 
     except Exception as e:
         logger.error(f"Error in send_data_to_external: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500  
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Progress of a queued send
+@app.route('/api/send/<int:job_id>', methods=['GET'])
+def get_send_job(job_id):
+    try:
+        job = sync_worker.get_job(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": f"Send job {job_id} not found"}), 404
+        return jsonify({"status": "success", "job": job})
+    except Exception as e:
+        logger.error(f"Error in get_send_job: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 # creating own API to fetch data for a specific user from the database
 
 def get_user_data(user_id):
     """Fetch data for a specific user from the database."""
     try:
-        conn = sqlite3.connect("user_data.db")  # use your DB path
-        conn.row_factory = sqlite3.Row  # dict-like rows
-        cursor = conn.cursor()
+        with database.pooled() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row  # dict-like rows
 
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))  # your DB column is `id`, not `user_id`
-        row = cursor.fetchone()
-        conn.close()
+            cursor.execute(f"SELECT * FROM users WHERE rowid = ? AND {database.LIVE_SQL}", (user_id,))
+            row = cursor.fetchone()
 
         if row:
-            return dict(row)
+            # A legacy table's own id column may hold a UUID or NULL
+            return dict(row, id=user_id)
         else:
             return None
     except Exception as e:
@@ -490,6 +909,7 @@ def get_user_data(user_id):
 
 # API Endpoint
 @app.route('/api/users/<username>/<int:user_id>', methods=['GET'])
+@conditional_get
 def get_user(username, user_id):
     user_data = get_user_data(user_id)
     if user_data and user_data.get("username") == username:
@@ -506,5 +926,8 @@ if __name__ == '__main__':
         logger.info(f"✅ JSON file created/updated on startup at {JSON_FILE}")
     except Exception as e:
         logger.error(f"Failed to create/update JSON on startup: {str(e)}")
-    
+
+    # Resume queued sends, in the reloader's serving process only
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        sync_worker.worker.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
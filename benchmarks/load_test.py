@@ -0,0 +1,98 @@
+# Load test for the records API: throughput and latency at increasing concurrency.
+#
+# Start a server first, e.g. `python wsgi.py` (production) or `python app.py`
+# (development), then:
+#
+#   python benchmarks/load_test.py --url http://127.0.0.1:5000 --concurrency 1,8,32 --duration 10
+#
+# Every client thread keeps one keep-alive session and requests the paths in turn.
+import argparse
+import threading
+import time
+
+import requests
+
+DEFAULT_PATHS = ["/api/users/count", "/api/users?limit=100", "/api/users/1"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def client(base_url, paths, deadline, latencies, errors, lock):
+    session = requests.Session()
+    own_latencies = []
+    own_errors = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=30)
+            response.content
+            if response.status_code >= 400:
+                own_errors += 1
+        except requests.RequestException:
+            own_errors += 1
+        own_latencies.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(own_latencies)
+        errors.append(own_errors)
+
+
+def run_level(base_url, paths, concurrency, duration):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(base_url, paths, deadline, latencies, errors, lock))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the records API")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server base URL")
+    parser.add_argument("--path", action="append", dest="paths", help="path to request (repeatable)")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client thread counts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    args = parser.parse_args()
+
+    paths = args.paths or DEFAULT_PATHS
+    base_url = args.url.rstrip("/")
+    # Warm up caches and the server's connection pool before measuring
+    run_level(base_url, paths, 1, 1)
+
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        result = run_level(base_url, paths, concurrency, args.duration)
+        print(
+            f"{result['concurrency']:>8} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+            f"{result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
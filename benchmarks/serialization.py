@@ -0,0 +1,115 @@
+# Payload size and serialization time of the records JSON at several table sizes:
+# the old indent=4 snapshot, compact stdlib JSON, codec.dumps (orjson when
+# installed), and the compressed sizes the API would send.
+#
+#   python benchmarks/serialization.py --sizes 10000,100000,1000000
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec
+from database import USER_FIELDS, INTEGER_FIELDS, REAL_FIELDS, DATE_FIELDS
+
+MODES = ["CPAP", "Auto CPAP", "S", "ST", "T", "VAPS"]
+
+
+# Distinct synthetic records. They repeat every TEMPLATE_COUNT ids, about 6.7 MB
+# of JSON, which is further apart than gzip's or brotli's window reaches, so
+# compressed sizes stay realistic while 1M records fit in memory.
+TEMPLATE_COUNT = 10000
+
+
+# Synthetic records with the same fields and value shapes as the snapshot
+def make_users(count):
+    rng = random.Random(0)
+    templates = []
+    for _ in range(min(count, TEMPLATE_COUNT)):
+        user = {}
+        for field in USER_FIELDS:
+            if field in INTEGER_FIELDS:
+                user[field] = str(rng.randint(0, 200))
+            elif field in REAL_FIELDS:
+                user[field] = f"{rng.uniform(0, 30):.1f}"
+            elif field in DATE_FIELDS:
+                user[field] = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025"
+            elif field == "mode_name":
+                user[field] = rng.choice(MODES)
+            else:
+                user[field] = f"{field[:4]}{rng.randint(1000, 9999)}"
+        templates.append(user)
+    return {str(record_id): templates[record_id % len(templates)] for record_id in range(1, count + 1)}
+
+
+# Above this many records the indent=4 document is streamed instead of built in
+# memory: the pure-Python indenting encoder needs several GB for 1M records
+INDENT_IN_MEMORY_LIMIT = 100000
+
+
+# File-like sink that only counts the UTF-8 bytes written to it
+class ByteCounter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text.encode("utf-8"))
+
+    def __len__(self):
+        return self.size
+
+
+def streamed_indent_dump(users):
+    sink = ByteCounter()
+    json.dump(users, sink, indent=4, ensure_ascii=False)
+    return sink
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark records JSON serialization and compression")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated record counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the best is reported")
+    args = parser.parse_args()
+
+    print(f"serializer: {'orjson' if codec.orjson else 'stdlib json'}; encodings: {', '.join(codec.ENCODINGS)}")
+    print(f"{'records':>9} {'variant':<22} {'bytes':>13} {'seconds':>9}")
+    for count in (int(value) for value in args.sizes.split(",")):
+        users = make_users(count)
+        if count > INDENT_IN_MEMORY_LIMIT:
+            indent_variant = ("stdlib indent=4 stream", lambda: streamed_indent_dump(users))
+        else:
+            indent_variant = ("stdlib indent=4", lambda: json.dumps(users, indent=4, ensure_ascii=False).encode("utf-8"))
+        variants = [
+            indent_variant,
+            ("stdlib compact", lambda: json.dumps(users, ensure_ascii=False, separators=(",", ":")).encode("utf-8")),
+            ("codec.dumps", lambda: codec.dumps(users)),
+        ]
+        for name, function in variants:
+            body, seconds = timed(function, args.repeat)
+            print(f"{count:>9} {name:<22} {len(body):>13,} {seconds:>9.3f}")
+            body = None
+
+        body = codec.dumps(users)
+        for encoding in codec.ENCODINGS:
+            compressed, seconds = timed(lambda: codec.compress(body, encoding), args.repeat)
+            print(f"{count:>9} {'codec.dumps + ' + encoding:<22} {len(compressed):>13,} {seconds:>9.3f}")
+        print(f"{count:>9} {'gzip level 1':<22} {len(gzip.compress(body, compresslevel=1)):>13,}")
+        del users
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# JSON serialization and response compression shared by the API, the snapshot
+# writer and the sync worker. orjson and brotli are used when installed; without
+# them JSON falls back to the standard library and only gzip is offered.
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+# Higher qualities compress little better and are far slower for per-request bodies
+BROTLI_QUALITY = 5
+
+
+def default(obj):
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# Compact UTF-8 JSON as bytes
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Content codings this server can produce, most preferred first
+ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+# Pick the coding to answer a request with, from its parsed Accept-Encoding
+# (werkzeug's request.accept_encodings). None means send the body as is.
+def negotiate_encoding(accept):
+    best = None
+    best_quality = 0
+    for encoding in ENCODINGS:
+        quality = accept.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
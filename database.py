@@ -0,0 +1,949 @@
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
+import logging
+import math
+import time
+import re
+import unicodedata
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "user_data.db"
+
+# Schema versions, stored in PRAGMA user_version:
+#   0  unversioned database (new, or created before versioning)
+#   1  legacy all-TEXT users table, online migration to the typed table pending
+#   2  typed users table
+# Later versions are reached through UPGRADES from version 2.
+LEGACY_SCHEMA_VERSION = 1
+TYPED_SCHEMA_VERSION = 2
+
+# Columns of the users table (besides id), in the order every query selects them
+USER_FIELDS = [
+    "string_serial_number", "report_uniq_id_uid", "device_user_id", "device_reading",
+    "start_date", "end_date", "mask", "mask_type", "start_hour_min", "end_hour_min",
+    "timedifferenceinMinute", "reading_dev_mode", "mode_name", "device_name",
+    "csa_count", "osa_count", "hsa_count", "a_flex", "a_flex_level", "a_flex_value",
+    "leak", "max_pressure", "min_pressure", "pressurechangecount", "ratechangeFactor",
+    "final_date", "date_time", "old_or_new"
+]
+
+# Typed columns. Dates are stored as YYYY-MM-DD (date_time as YYYY-MM-DD HH:MM)
+# so they sort and compare in SQL; clients still send and receive DD/MM/YYYY.
+INTEGER_FIELDS = [
+    "timedifferenceinMinute", "csa_count", "osa_count", "hsa_count", "a_flex_level",
+    "pressurechangecount"
+]
+REAL_FIELDS = ["device_reading", "a_flex_value", "leak", "max_pressure", "min_pressure", "ratechangeFactor"]
+DATE_FIELDS = ["start_date", "end_date", "final_date", "date_time"]
+
+# Per-connection tuning. The database runs in WAL mode (set once by init_db), where
+# readers never block the writer or each other, so NORMAL sync is still crash-safe.
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 30000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+]
+# Prepared statements kept per connection; the API reuses a small set of queries
+CACHED_STATEMENTS = 256
+# Idle connections kept by the server pool, roughly one per worker thread
+POOL_SIZE = 16
+
+
+# Every module opens the records database through here
+def connect(check_same_thread=True):
+    conn = sqlite3.connect(
+        DB_PATH, timeout=30, cached_statements=CACHED_STATEMENTS,
+        check_same_thread=check_same_thread
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Connections shared by the server's worker threads. A connection is only used by
+# one thread at a time, and goes back to the pool with its statement cache warm.
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE):
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = connect(check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            # Never hand out a connection holding a transaction (or a read snapshot)
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool()
+
+
+# Borrow a pooled connection: "with database.pooled() as conn: ..."
+def pooled():
+    return pool.connection()
+
+
+def get_schema_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+def set_schema_version(cursor, version):
+    cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+
+# Soft delete: a deleted record keeps its row with deleted_at set until it is purged,
+# so a delete can be undone and other readers can tell it went away. Every read of
+# current records filters on LIVE_SQL.
+LIVE_SQL = "deleted_at IS NULL"
+# Days a soft-deleted record is kept before it is purged
+DELETED_RETENTION_DAYS = 30
+# Row ids per statement when deleting or restoring many records
+ID_CHUNK_SIZE = 500
+
+
+# Rows copied per transaction by the online migration to the typed table
+MIGRATION_CHUNK_SIZE = 500
+TYPED_MIGRATION = "typed_users"
+
+DMY_DATE_RE = re.compile(r"^(\d{2})/(\d{2})/(\d{4})(.*)$")
+ISO_DATE_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})(.*)$")
+
+
+def column_type(field):
+    if field in INTEGER_FIELDS:
+        return "INTEGER"
+    if field in REAL_FIELDS:
+        return "REAL"
+    return "TEXT"
+
+
+# SQL expression turning a DD/MM/YYYY[ HH:MM] column into YYYY-MM-DD[ HH:MM].
+# Values already in ISO form are returned unchanged, so it works on both layouts.
+def iso_date_sql(column):
+    return (
+        f"(CASE WHEN {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*' "
+        f"THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) "
+        f"|| substr({column}, 11) ELSE {column} END)"
+    )
+
+
+# Session start as an ISO date; the indexed expression used for date ranges and ordering
+START_DATE_SQL = iso_date_sql("start_date")
+
+
+# Normalized session start, "YYYY-MM-DD HH:MM" (or "YYYY-MM-DD" without a valid
+# start time). Records without a valid start date fall back to their final date,
+# and records with neither get ''. Works on both the legacy and typed layouts.
+def session_start_sql():
+    iso_day = "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+    start, final = iso_date_sql("start_date"), iso_date_sql("final_date")
+    return (
+        f"(CASE WHEN {start} GLOB {iso_day} THEN substr({start}, 1, 10) || "
+        f"(CASE WHEN start_hour_min GLOB '[0-9][0-9]:[0-9][0-9]*' THEN ' ' || substr(start_hour_min, 1, 5) "
+        f"WHEN start_hour_min GLOB '[0-9]:[0-9][0-9]*' THEN ' 0' || substr(start_hour_min, 1, 4) "
+        f"ELSE '' END) "
+        f"WHEN {final} GLOB {iso_day} THEN substr({final}, 1, 10) ELSE '' END)"
+    )
+
+
+# Parse a numeric field sent by a client or typed into a form. Empty is stored as
+# NULL; anything that is not a number (e.g. "24 L/min") raises ValueError, so only
+# numbers reach the typed columns. Numbers come back in canonical form ("03" as "3").
+def parse_number(field, value):
+    if value is None or value == "":
+        return None
+    try:
+        if field in INTEGER_FIELDS and isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{field} must be a number, got {value!r}")
+    if field in INTEGER_FIELDS:
+        if not number.is_integer():
+            raise ValueError(f"{field} must be a whole number, got {value!r}")
+        return int(number)
+    return number
+
+
+# Convert a value received from a client into its stored form. Raises ValueError
+# for a numeric field that is not a number.
+def to_db_value(field, value):
+    if field in INTEGER_FIELDS or field in REAL_FIELDS:
+        return parse_number(field, value)
+    if field in DATE_FIELDS and isinstance(value, str):
+        match = DMY_DATE_RE.match(value)
+        if match:
+            return f"{match[3]}-{match[2]}-{match[1]}{match[4]}"
+    return value
+
+
+# Convert a stored value back into the string clients and the UI expect
+def from_db_value(field, value):
+    if value is None:
+        return ""
+    if field in DATE_FIELDS and isinstance(value, str):
+        match = ISO_DATE_RE.match(value)
+        if match:
+            return f"{match[3]}/{match[2]}/{match[1]}{match[4]}"
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return value if isinstance(value, str) else str(value)
+
+
+# Stored values for a record dict, in USER_FIELDS order
+def to_db_values(record):
+    return tuple(to_db_value(field, record.get(field, '')) for field in USER_FIELDS)
+
+
+# Display strings for a row of stored values in USER_FIELDS order
+def from_db_values(row):
+    return [from_db_value(field, value) for field, value in zip(USER_FIELDS, row)]
+
+
+def create_users_table(cursor, table="users"):
+    columns = ",\n".join(f"    {field} {column_type(field)}" for field in USER_FIELDS)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        {columns}
+        )
+    """)
+    add_session_start_column(cursor, table)
+    add_deleted_at_column(cursor, table)
+
+
+def table_has_column(cursor, table, column):
+    cursor.execute(f"PRAGMA table_xinfo({table})")
+    return any(info[1] == column for info in cursor.fetchall())
+
+
+# session_start is generated from the date columns, so every writer keeps it
+# current without listing it; its indexes store the value when a row is written.
+# Adding a virtual column does not rewrite the table.
+def add_session_start_column(cursor, table="users"):
+    if table_has_column(cursor, table, "session_start"):
+        return
+    cursor.execute(
+        f"ALTER TABLE {table} ADD COLUMN session_start TEXT GENERATED ALWAYS AS ({session_start_sql()}) VIRTUAL"
+    )
+
+
+def add_deleted_at_column(cursor, table="users"):
+    if not table_has_column(cursor, table, "deleted_at"):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN deleted_at TEXT")
+
+
+# Make re-uploaded reports unique per device. Duplicates already in the table are
+# removed once, keeping the latest upload, before the unique index is created.
+def create_report_uid_index(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_users_report_uid'")
+    if cursor.fetchone():
+        return
+    cursor.execute("""
+        DELETE FROM users
+        WHERE report_uniq_id_uid <> '' AND rowid NOT IN (
+            SELECT MAX(rowid) FROM users
+            WHERE report_uniq_id_uid <> ''
+            GROUP BY string_serial_number, report_uniq_id_uid
+        )
+    """)
+    if cursor.rowcount:
+        logger.info(f"Removed {cursor.rowcount} duplicate report uploads")
+    cursor.execute("""
+        CREATE UNIQUE INDEX idx_users_report_uid
+        ON users (string_serial_number, report_uniq_id_uid)
+        WHERE report_uniq_id_uid <> ''
+    """)
+
+
+# Indexes and triggers that live on the users table. They are dropped with the
+# table, so the migration recreates them after swapping in the typed table.
+def create_users_objects(cursor):
+    # Data version counter, bumped by every write to users
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS users_version_{event.lower()}
+            AFTER {event} ON users
+            BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+    # Filter indexes; each entry also carries the id, so filtered pages are
+    # served in id order straight from the index
+    for field in ("string_serial_number", "device_user_id", "mode_name"):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{field} ON users ({field})")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_users_start_date ON users ({START_DATE_SQL})")
+    create_session_start_indexes(cursor)
+    create_deleted_at_index(cursor)
+
+    create_report_uid_index(cursor)
+    create_report_lookup_index(cursor)
+    create_change_tracking(cursor)
+    create_record_counts(cursor)
+
+
+# Live record counts kept by triggers, so counting never scans users: the total
+# (scope 'total', key ''), per device (scope 'device', key string_serial_number)
+# and per CPAP type (scope 'mode', key mode_name). Soft-deleted records are not
+# counted. A missing key is counted under ''.
+COUNT_SCOPES = {"device": "string_serial_number", "mode": "mode_name"}
+
+
+def create_record_counts(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'record_counts'")
+    is_new = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS record_counts (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    """)
+
+    def adjust(row, delta):
+        keys = [("'total'", "''")] + [
+            (f"'{scope}'", f"COALESCE({row}.{column}, '')") for scope, column in COUNT_SCOPES.items()
+        ]
+        return "\n".join(
+            f"INSERT INTO record_counts (scope, key, count) VALUES ({scope}, {key}, {delta}) "
+            f"ON CONFLICT (scope, key) DO UPDATE SET count = count + {delta};"
+            for scope, key in keys
+        )
+
+    triggers = [
+        ("insert", "AFTER INSERT", "NEW", 1),
+        ("delete", "AFTER DELETE", "OLD", -1),
+        # Only writes that can move a record between counts
+        ("update_old", "AFTER UPDATE OF deleted_at, string_serial_number, mode_name", "OLD", -1),
+        ("update_new", "AFTER UPDATE OF deleted_at, string_serial_number, mode_name", "NEW", 1),
+    ]
+    for name, event, row, delta in triggers:
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS users_count_{name}
+            {event} ON users
+            WHEN {row}.deleted_at IS NULL
+            BEGIN
+                {adjust(row, delta)}
+            END
+        """)
+    if is_new:
+        rebuild_record_counts(cursor)
+
+
+def rebuild_record_counts(cursor):
+    cursor.execute("DELETE FROM record_counts")
+    cursor.execute(f"INSERT INTO record_counts SELECT 'total', '', COUNT(*) FROM users WHERE {LIVE_SQL}")
+    for scope, column in COUNT_SCOPES.items():
+        cursor.execute(f"""
+            INSERT INTO record_counts
+            SELECT '{scope}', COALESCE({column}, ''), COUNT(*) FROM users WHERE {LIVE_SQL}
+            GROUP BY COALESCE({column}, '')
+        """)
+
+
+# Live records overall, or for one device or CPAP type
+def count_records(cursor, scope="total", key=""):
+    cursor.execute("SELECT count FROM record_counts WHERE scope = ? AND key = ?", (scope, key))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+# {key: count} of live records for every device or CPAP type
+def record_count_breakdown(cursor, scope):
+    cursor.execute("SELECT key, count FROM record_counts WHERE scope = ? AND count > 0 ORDER BY key", (scope,))
+    return dict(cursor.fetchall())
+
+
+# Find uploads by report UID across devices (the unique index leads with the device)
+def create_report_lookup_index(cursor):
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_report_uniq_id_uid ON users (report_uniq_id_uid)"
+    )
+
+
+# Change log for delta syncs: one row per record id ever written, holding the
+# sequence number of its latest insert, update or delete. Sequence numbers only
+# grow, so "seq > cursor" is everything a destination has not acknowledged yet. A
+# record that is soft-deleted or gone from users is sent as a tombstone.
+# Records are keyed by rowid: a legacy table's id column may be a UUID or NULL,
+# and its rowid is what the typed migration keeps as the id. The triggers are
+# recreated on every call, so tables set up with older definitions are corrected.
+def create_change_tracking(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS record_changes (
+            record_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL UNIQUE
+        )
+    """)
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"DROP TRIGGER IF EXISTS users_change_{event.lower()}")
+        cursor.execute(f"""
+            CREATE TRIGGER users_change_{event.lower()}
+            AFTER {event} ON users
+            BEGIN
+                INSERT OR REPLACE INTO record_changes (record_id, seq)
+                VALUES ({row}.rowid, (SELECT COALESCE(MAX(seq), 0) + 1 FROM record_changes));
+            END
+        """)
+
+
+# Only soft-deleted rows are indexed, for undo and purging
+def create_deleted_at_index(cursor):
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_deleted_at ON users (deleted_at) WHERE deleted_at IS NOT NULL"
+    )
+
+
+# Serve the newest-first record listing and its date ranges, overall and for one
+# CPAP type (mode_name), one page at a time in index order
+def create_session_start_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_session_start ON users (session_start)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_mode_session_start ON users (mode_name, session_start)")
+
+
+def users_table_is_typed(cursor):
+    cursor.execute("PRAGMA table_info(users)")
+    types = {row[1]: row[2].upper() for row in cursor.fetchall()}
+    return types.get("csa_count") == "INTEGER"
+
+
+# Columns the typed migration copies from the legacy table
+MIGRATED_FIELDS = USER_FIELDS + ["deleted_at"]
+
+
+NUMERIC_FIELDS = INTEGER_FIELDS + REAL_FIELDS
+
+
+# SQL condition: a legacy text value of a numeric field holds a number (an optional
+# sign, digits and at most one decimal point; whole for integer fields), the same
+# values parse_number accepts from the form. The SQL has to stand alone because the
+# mirror triggers run it on every connection, the desktop app's included.
+def is_number_sql(field, column):
+    text = f"trim({column})"
+    digits = f"(CASE WHEN substr({text}, 1, 1) IN ('+', '-') THEN substr({text}, 2) ELSE {text} END)"
+    condition = f"{digits} GLOB '*[0-9]*' AND {digits} NOT GLOB '*[^0-9.]*' AND {digits} NOT GLOB '*.*.*'"
+    if field in INTEGER_FIELDS:
+        condition += f" AND {digits} NOT GLOB '*.*[^0]*'"
+    return f"({condition})"
+
+
+# SQL condition: a legacy value the typed column cannot store. Empty values become NULL.
+def is_rejected_sql(field, column):
+    return f"({column} IS NOT NULL AND trim({column}) <> '' AND NOT {is_number_sql(field, column)})"
+
+
+# Column expressions converting a legacy all-TEXT row (prefix "" or "NEW.") to the
+# typed layout, in MIGRATED_FIELDS order. Numeric values that are not numbers are
+# stored as NULL; migration_rejects keeps the original text.
+def typed_value_sql(prefix=""):
+    expressions = []
+    for field in MIGRATED_FIELDS:
+        column = f"{prefix}{field}"
+        if field in DATE_FIELDS:
+            expressions.append(iso_date_sql(column))
+        elif field in NUMERIC_FIELDS:
+            expressions.append(
+                f"(CASE WHEN {is_number_sql(field, column)} THEN CAST(trim({column}) AS {column_type(field)}) END)"
+            )
+        else:
+            expressions.append(column)
+    return ", ".join(expressions)
+
+
+# SELECT of (record id, field, original text) for every numeric value of a legacy
+# row that is not a number: prefix "NEW." in a trigger, or "" with a WHERE clause
+# over users
+def rejected_values_sql(prefix="", where=""):
+    row_id = f"{prefix}rowid"
+    source = f" FROM users WHERE {where} AND " if where else " WHERE "
+    return " UNION ALL ".join(
+        f"SELECT {row_id}, '{field}', {prefix}{field}{source}{is_rejected_sql(field, prefix + field)}"
+        for field in NUMERIC_FIELDS
+    )
+
+
+# Legacy numeric values the typed table could not store, kept so they are not lost
+def create_migration_rejects(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS migration_rejects (
+            record_id INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (record_id, field)
+        )
+    """)
+
+
+# Prepare the online migration of a legacy users table: the typed copy, a progress
+# row, and triggers mirroring every write on the legacy table into the copy so rows
+# that were already copied stay current while the app keeps using the legacy table.
+# Rows inserted after this point reach the copy through the triggers alone, so the
+# chunked copy stops at the highest rowid present now (target_rowid).
+def begin_typed_migration(cursor):
+    create_users_table(cursor, "users_v2")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL DEFAULT 0,
+            target_rowid INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO schema_migrations (name, target_rowid) SELECT ?, IFNULL(MAX(rowid), 0) FROM users",
+        (TYPED_MIGRATION,)
+    )
+    create_migration_rejects(cursor)
+
+    create_mirror_triggers(cursor)
+
+
+# Triggers mirroring writes on the legacy table into users_v2. They are recreated
+# when a pending migration is resumed, so they always copy the current columns.
+def create_mirror_triggers(cursor):
+    for event in ("insert", "update", "delete"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS users_v2_mirror_{event}")
+    columns = ", ".join(MIGRATED_FIELDS)
+    upsert_new = f"""
+        INSERT OR REPLACE INTO users_v2 (id, {columns}) VALUES (NEW.rowid, {typed_value_sql('NEW.')});
+        INSERT OR REPLACE INTO migration_rejects (record_id, field, value) {rejected_values_sql('NEW.')};
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_v2_mirror_insert AFTER INSERT ON users
+        BEGIN
+            {upsert_new}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_v2_mirror_update AFTER UPDATE ON users
+        BEGIN
+            DELETE FROM users_v2 WHERE id = OLD.rowid;
+            DELETE FROM migration_rejects WHERE record_id = OLD.rowid;
+            {upsert_new}
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_v2_mirror_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_v2 WHERE id = OLD.rowid;
+            DELETE FROM migration_rejects WHERE record_id = OLD.rowid;
+        END
+    """)
+
+
+# Copy the next chunk of legacy rows into the typed table, or swap the tables once
+# everything is copied. Progress is committed with each chunk, so an interrupted
+# migration resumes where it stopped. Returns True while work remains.
+def migrate_typed_chunk(conn, chunk_size=MIGRATION_CHUNK_SIZE):
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        if get_schema_version(cursor) != LEGACY_SCHEMA_VERSION:
+            conn.rollback()
+            return False
+        cursor.execute(
+            "SELECT last_rowid, target_rowid FROM schema_migrations WHERE name = ?",
+            (TYPED_MIGRATION,)
+        )
+        progress = cursor.fetchone()
+
+        last_rowid, target_rowid = progress[0], progress[1]
+        cursor.execute(
+            "SELECT MAX(rowid) FROM (SELECT rowid FROM users WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, target_rowid, chunk_size)
+        )
+        upper_rowid = cursor.fetchone()[0]
+        if upper_rowid is None:
+            finish_typed_migration(cursor)
+            conn.commit()
+            logger.info("Typed users table migration completed")
+            return False
+
+        # Rows the mirror triggers already wrote are newer than the legacy copy
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO users_v2 (id, {', '.join(MIGRATED_FIELDS)})
+            SELECT rowid, {typed_value_sql()} FROM users
+            WHERE rowid > ? AND rowid <= ?
+        """, (last_rowid, upper_rowid))
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO migration_rejects (record_id, field, value)
+            {rejected_values_sql(where="rowid > :low AND rowid <= :high")}
+        """, {"low": last_rowid, "high": upper_rowid})
+        if cursor.rowcount > 0:
+            cursor.execute(
+                "SELECT COUNT(DISTINCT record_id) FROM migration_rejects WHERE record_id > ? AND record_id <= ?",
+                (last_rowid, upper_rowid)
+            )
+            logger.warning(
+                f"Typed users migration: {cursor.fetchone()[0]} rows up to rowid {upper_rowid} have "
+                f"numeric fields that are not numbers; stored empty, originals kept in migration_rejects"
+            )
+        cursor.execute(
+            "UPDATE schema_migrations SET last_rowid = ? WHERE name = ?",
+            (upper_rowid, TYPED_MIGRATION)
+        )
+        conn.commit()
+        logger.debug(f"Typed users migration copied rows up to rowid {upper_rowid}")
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def finish_typed_migration(cursor):
+    cursor.execute("SELECT COUNT(DISTINCT record_id), COUNT(*) FROM migration_rejects")
+    rows, values = cursor.fetchone()
+    if rows:
+        logger.warning(
+            f"Typed users migration: {values} non-numeric values in {rows} rows were stored empty; "
+            f"the original text is kept in migration_rejects"
+        )
+    # Dropping the legacy table also drops its mirror triggers and indexes
+    cursor.execute("DROP TABLE users")
+    cursor.execute("ALTER TABLE users_v2 RENAME TO users")
+    add_session_start_column(cursor)
+    add_deleted_at_column(cursor)
+    create_users_objects(cursor)
+    cursor.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    cursor.execute("DELETE FROM schema_migrations WHERE name = ?", (TYPED_MIGRATION,))
+    set_schema_version(cursor, TYPED_SCHEMA_VERSION)
+    apply_upgrades(cursor)
+
+
+# Run the typed migration chunk by chunk, pausing between chunks so other
+# connections can read and write in the meantime
+def run_typed_migration(chunk_size=MIGRATION_CHUNK_SIZE, pause=0.05):
+    conn = connect()
+    try:
+        while True:
+            try:
+                if not migrate_typed_chunk(conn, chunk_size):
+                    break
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Typed users migration step failed, retrying: {e}")
+            time.sleep(pause)
+    except Exception as e:
+        logger.error(f"Typed users migration stopped: {e}")
+    finally:
+        conn.close()
+
+
+def start_background_migration():
+    thread = threading.Thread(target=run_typed_migration, name="typed-users-migration", daemon=True)
+    thread.start()
+    return thread
+
+
+# Text columns covered by the full-text index
+FTS_FIELDS = ["string_serial_number", "report_uniq_id_uid", "mask", "mask_type", "mode_name", "device_name"]
+
+
+# Full-text index over the searchable text columns. It stores no copy of the text
+# (external content) and is kept in sync with users by triggers; the initial
+# 'rebuild' fills it in one pass. SQLite builds without FTS5 skip it, and
+# searches fall back to LIKE.
+def create_records_fts(cursor):
+    columns = ", ".join(FTS_FIELDS)
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                {columns}, content='users', content_rowid='id', prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Full-text search unavailable: {e}")
+        return
+    new_values = ", ".join(f"NEW.{field}" for field in FTS_FIELDS)
+    old_values = ", ".join(f"OLD.{field}" for field in FTS_FIELDS)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF {columns} ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO users_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    """)
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def has_records_fts(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+    return cursor.fetchone() is not None
+
+
+# FTS5 query for free text typed by a user: every word must match, as a prefix
+def fts_match_query(text):
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+FTS_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+# The tokens FTS5's default unicode61 tokenizer makes of text: runs of letters and
+# digits, lowercased and without diacritics. A word of fts_match_query is the
+# phrase of its tokens, the last one matched as a prefix.
+def fts_tokens(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return FTS_TOKEN_RE.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+# A migration started by an older version of the app: give both tables the columns
+# added since, and mirror them too
+def resume_typed_migration(cursor):
+    create_users_table(cursor)
+    create_users_table(cursor, "users_v2")
+    create_migration_rejects(cursor)
+    create_mirror_triggers(cursor)
+    create_change_tracking(cursor)
+
+
+# Set-based upgrades of the typed schema, keyed by the version they produce.
+# Each one runs once, inside the transaction that records its version.
+def upgrade_session_start(cursor):
+    add_session_start_column(cursor)
+    create_session_start_indexes(cursor)
+
+
+def upgrade_soft_delete(cursor):
+    add_deleted_at_column(cursor)
+    create_deleted_at_index(cursor)
+
+
+# Durable queue of outbound syncs (see sync_worker.py). A job is one /api/send call,
+# sent in its destination's body format; each of its batches covers a range of
+# record ids and is sent and retried on its own.
+def create_sync_outbox(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_jobs (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            format TEXT NOT NULL DEFAULT 'batch',
+            status TEXT NOT NULL DEFAULT 'pending',
+            records INTEGER NOT NULL DEFAULT 0,
+            batches INTEGER NOT NULL DEFAULT 0,
+            batches_sent INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            finished_at TEXT,
+            last_error TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_outbox (
+            id INTEGER PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES sync_jobs (id),
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            records INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_outbox_due ON sync_outbox (status, next_attempt_at)")
+
+
+# Give every record without a change row one. They are numbered above every
+# sequence already issued, e.g. by triggers that ran during a legacy migration, so
+# none collides with an existing change and none is left out of a sync. On an empty
+# log this is seq = rowid.
+def backfill_record_changes(cursor):
+    cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM record_changes")
+    max_seq = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO record_changes (record_id, seq)
+        SELECT rowid, ? + rowid FROM users
+        WHERE rowid NOT IN (SELECT record_id FROM record_changes)
+    """, (max_seq,))
+    if cursor.rowcount:
+        logger.info(f"Added {cursor.rowcount} untracked records to the change log")
+
+
+# Track changes from here on, and send outbox batches by change sequence instead of
+# record id. On a database that was typed already the log starts empty, so existing
+# records get seq = id and batches queued by version 6 keep covering the same records.
+def upgrade_change_tracking(cursor):
+    create_change_tracking(cursor)
+    backfill_record_changes(cursor)
+    cursor.execute("ALTER TABLE sync_outbox RENAME COLUMN first_id TO first_seq")
+    cursor.execute("ALTER TABLE sync_outbox RENAME COLUMN last_id TO last_seq")
+    # The change range a job covers: (after_seq, upto_seq]
+    cursor.execute("ALTER TABLE sync_jobs ADD COLUMN after_seq INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE sync_jobs ADD COLUMN upto_seq INTEGER NOT NULL DEFAULT 0")
+    # Last change sequence each destination has acknowledged
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_cursors (
+            url TEXT PRIMARY KEY,
+            acked_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+
+
+UPGRADES = {
+    3: create_records_fts,
+    4: upgrade_session_start,
+    5: upgrade_soft_delete,
+    6: create_sync_outbox,
+    7: upgrade_change_tracking,
+    8: create_report_lookup_index,
+    9: create_record_counts,
+}
+SCHEMA_VERSION = max(UPGRADES, default=TYPED_SCHEMA_VERSION)
+
+
+def apply_upgrades(cursor):
+    version = get_schema_version(cursor)
+    for target in sorted(UPGRADES):
+        if target > version:
+            UPGRADES[target](cursor)
+            set_schema_version(cursor, target)
+            logger.info(f"Upgraded records schema to version {target}")
+
+
+# Give an unversioned database its first version. A missing users table is created
+# typed; a legacy table keeps serving reads and writes while the typed migration runs.
+def create_schema(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+    has_users = cursor.fetchone() is not None
+    create_users_table(cursor)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    create_users_objects(cursor)
+
+    if has_users and not users_table_is_typed(cursor):
+        begin_typed_migration(cursor)
+        version = LEGACY_SCHEMA_VERSION
+    else:
+        version = TYPED_SCHEMA_VERSION
+    set_schema_version(cursor, version)
+    return version
+
+
+# Bring the database to SCHEMA_VERSION. On an up-to-date database this only reads
+# PRAGMA user_version, so starting either app never scans or rewrites the table.
+# Returns True while the legacy-to-typed migration is still running.
+def init_db(background=True):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        # Persistent; a no-op once the database is in WAL mode
+        cursor.execute("PRAGMA journal_mode = WAL")
+        if get_schema_version(cursor) != SCHEMA_VERSION:
+            cursor.execute("BEGIN IMMEDIATE")
+            # Another process may have upgraded it while we waited for the lock
+            version = get_schema_version(cursor)
+            if version == 0:
+                version = create_schema(cursor)
+            elif version == LEGACY_SCHEMA_VERSION:
+                resume_typed_migration(cursor)
+            if version >= TYPED_SCHEMA_VERSION:
+                apply_upgrades(cursor)
+            conn.commit()
+        migration_pending = get_schema_version(cursor) == LEGACY_SCHEMA_VERSION
+        if not migration_pending:
+            purge_deleted_records(conn)
+    finally:
+        conn.close()
+
+    if migration_pending:
+        logger.info("Legacy users table found, migrating to the typed layout")
+        if background:
+            start_background_migration()
+        else:
+            run_typed_migration(pause=0)
+    return migration_pending
+
+
+def deleted_at_now():
+    return datetime.now().isoformat(sep=" ")
+
+
+def id_chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+# Soft-delete records by rowid in one transaction. Returns the deletion stamp that
+# restore_records needs to undo exactly this delete.
+def soft_delete_records(conn, ids):
+    stamp = deleted_at_now()
+    with conn:
+        for chunk in id_chunks(ids):
+            conn.execute(
+                f"UPDATE users SET deleted_at = ? WHERE {LIVE_SQL} AND rowid IN ({', '.join('?' for _ in chunk)})",
+                [stamp] + chunk
+            )
+    return stamp
+
+
+def restore_records(conn, ids, stamp):
+    with conn:
+        for chunk in id_chunks(ids):
+            conn.execute(
+                f"UPDATE users SET deleted_at = NULL WHERE deleted_at = ? AND rowid IN ({', '.join('?' for _ in chunk)})",
+                [stamp] + chunk
+            )
+
+
+# Permanently remove records soft-deleted more than retention_days ago
+def purge_deleted_records(conn, retention_days=DELETED_RETENTION_DAYS):
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat(sep=" ")
+    try:
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM users WHERE deleted_at IS NOT NULL AND deleted_at < ?", (cutoff,)
+            )
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} deleted records")
+    except sqlite3.OperationalError as e:
+        # Busy with another writer; the next start purges them
+        logger.warning(f"Could not purge deleted records: {e}")
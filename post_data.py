@@ -13,6 +13,10 @@
 # response = requests.post(url, data=payload)
 
 # print(response.json())
+import gzip
+import json
+import os
+import random
 from flask import Flask, jsonify, request
 
 app = Flask(__name__)
@@ -30,5 +34,43 @@ def add_numbers():
     b = data.get("b", 0)
     return jsonify({"sum": a + b})
 
+# Stand-ins for the external API that /api/send delivers to (see sync_worker.py for
+# both body formats). Point app.py at one with CPAP_SYNC_URL=http://127.0.0.1:5001/sync,
+# or at /form with CPAP_SYNC_FORMAT=form as well; set SYNC_FAIL_RATE=0.3 to fail
+# some posts with 503 and watch them being retried.
+received = {}
+
+def simulated_outage():
+    return random.random() < float(os.environ.get("SYNC_FAIL_RATE", "0"))
+
+@app.route('/sync', methods=['POST'])
+def receive_sync():
+    if simulated_outage():
+        return jsonify({"status": "error", "message": "Simulated outage"}), 503
+    body = request.get_data()
+    if request.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    data = json.loads(body)
+    received.update(data["users"])
+    for record_id in data.get("deleted", []):
+        received.pop(str(record_id), None)
+    return jsonify({
+        "status": "success",
+        "batch_id": data["batch_id"],
+        "received": len(data["users"]),
+        "total": len(received)
+    })
+
+# Like tanya.php: the whole record set as JSON in the "data" form field
+@app.route('/form', methods=['POST'])
+def receive_form():
+    if simulated_outage():
+        return jsonify({"status": "error", "message": "Simulated outage"}), 503
+    users = json.loads(request.form["data"])
+    received.clear()
+    received.update(users)
+    return jsonify({"status": "success", "total": len(received)})
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # 5000 is taken by app.py
+    app.run(debug=True, port=5001)
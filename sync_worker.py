@@ -0,0 +1,409 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import requests
+
+import codec
+import database
+from database import USER_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Body formats a destination can take:
+#
+# FORM_FORMAT, the production tanya.php endpoint's contract: one form POST whose
+# "data" field is the JSON of every live record, {"<id>": {record}, ...}. The
+# endpoint cannot acknowledge changes, so every send is the full record set, a 2xx
+# only marks the job done, and the destination's cursor never advances.
+#
+# BATCH_FORMAT, for receivers that support delta syncs (post_data.py's /sync): one
+# POST per batch with Content-Type: application/json and Content-Encoding: gzip,
+# whose body is
+#   {"job_id": 1, "batch_id": 1, "users": {"<id>": {record}, ...}, "deleted": [<id>, ...]}
+# A batch is acknowledged by a 2xx answer whose JSON echoes its "batch_id"; once
+# every batch of a job is, the destination's cursor advances past the job's changes.
+# Any other 2xx fails the job.
+#
+# In both formats 5xx, 408, 425 and 429 are retried; other answers fail the job.
+FORM_FORMAT = "form"
+BATCH_FORMAT = "batch"
+
+LEGACY_SYNC_URL = "https://deckmount.in/api/web/tanya.php?user_id=1"
+# Destinations that need a format other than BATCH_FORMAT
+DESTINATION_FORMATS = {LEGACY_SYNC_URL: FORM_FORMAT}
+
+# Where /api/send delivers records, and the format CPAP_SYNC_FORMAT names for it
+# (otherwise its entry in DESTINATION_FORMATS). Run post_data.py and set
+# CPAP_SYNC_URL=http://127.0.0.1:5001/sync to test against a local stand-in.
+SYNC_URL = os.environ.get("CPAP_SYNC_URL", LEGACY_SYNC_URL)
+SYNC_FORMAT = os.environ.get("CPAP_SYNC_FORMAT")
+
+# Records per POST
+SYNC_BATCH_SIZE = 500
+# (connect, read) timeout in seconds for one POST
+SYNC_TIMEOUT = (5, 30)
+# POSTs in flight at once
+SYNC_CONCURRENCY = 4
+# A batch is given up after this many failed attempts
+SYNC_MAX_ATTEMPTS = 8
+# Retry delays double from SYNC_BACKOFF_BASE seconds up to SYNC_BACKOFF_MAX
+SYNC_BACKOFF_BASE = 2
+SYNC_BACKOFF_MAX = 300
+# A claimed batch that is neither sent nor failed after this many seconds (its
+# sender died) is claimed again
+SYNC_LEASE = 120
+# Longest the worker sleeps before looking at the queue again
+SYNC_IDLE_POLL = 30
+
+# 4xx answers other than these will not get better by retrying
+RETRYABLE_STATUSES = {408, 425, 429}
+
+
+def now_text():
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def destination_format(url):
+    if url == SYNC_URL and SYNC_FORMAT:
+        return SYNC_FORMAT
+    return DESTINATION_FORMATS.get(url, BATCH_FORMAT)
+
+
+def get_acked_seq(cursor, url):
+    cursor.execute("SELECT acked_seq FROM sync_cursors WHERE url = ?", (url,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+# Queue a sync to url of every record created, updated or deleted since the last
+# change url acknowledged (or of everything, with full=True), and return the job
+# as a dict. Only change sequence ranges are stored here; each batch reads its
+# records when it is sent. A FORM_FORMAT destination always gets every record, in
+# one batch.
+def enqueue_sync(url=None, full=False, body_format=None):
+    url = url or SYNC_URL
+    body_format = body_format or destination_format(url)
+    if body_format not in (FORM_FORMAT, BATCH_FORMAT):
+        raise ValueError(f"Unknown sync body format '{body_format}'")
+    with database.pooled() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs still in flight to url are not counted as acknowledged, so a
+            # failure there cannot leave a gap; at worst a change is sent twice
+            full = full or body_format == FORM_FORMAT
+            after_seq = 0 if full else get_acked_seq(cursor, url)
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM record_changes")
+            upto_seq = max(cursor.fetchone()[0], after_seq)
+            cursor.execute(
+                "INSERT INTO sync_jobs (url, format, after_seq, upto_seq, created_at) VALUES (?, ?, ?, ?, ?)",
+                (url, body_format, after_seq, upto_seq, now_text())
+            )
+            job_id = cursor.lastrowid
+
+            batches = []
+            records = 0
+            if body_format == FORM_FORMAT:
+                cursor.execute(f"SELECT COUNT(*) FROM users WHERE {database.LIVE_SQL}")
+                records = cursor.fetchone()[0]
+                batches.append((job_id, after_seq, upto_seq, records))
+            else:
+                seqs = conn.execute(
+                    "SELECT seq FROM record_changes WHERE seq > ? AND seq <= ? ORDER BY seq", (after_seq, upto_seq)
+                )
+                while True:
+                    chunk = seqs.fetchmany(SYNC_BATCH_SIZE)
+                    if not chunk:
+                        break
+                    batches.append((job_id, chunk[0][0], chunk[-1][0], len(chunk)))
+                    records += len(chunk)
+            cursor.executemany(
+                "INSERT INTO sync_outbox (job_id, first_seq, last_seq, records) VALUES (?, ?, ?, ?)",
+                batches
+            )
+            cursor.execute(
+                "UPDATE sync_jobs SET records = ?, batches = ? WHERE id = ?",
+                (records, len(batches), job_id)
+            )
+            if not batches:
+                finish_job(cursor, job_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    worker.wake()
+    logger.info(
+        f"Queued sync job {job_id}: {records} changes after #{after_seq} in {len(batches)} batches to {url}"
+    )
+    return get_job(job_id)
+
+
+# Mark a job done and, for a format that acknowledges changes, advance its
+# destination's cursor to the end of the job's range, unless a change before the
+# range is still unacknowledged
+def finish_job(cursor, job_id):
+    cursor.execute(
+        "UPDATE sync_jobs SET status = 'done', finished_at = ? WHERE id = ? AND status = 'pending'",
+        (now_text(), job_id)
+    )
+    if not cursor.rowcount:
+        return
+    cursor.execute("SELECT url, format, after_seq, upto_seq FROM sync_jobs WHERE id = ?", (job_id,))
+    url, body_format, after_seq, upto_seq = cursor.fetchone()
+    if body_format != BATCH_FORMAT:
+        return
+    cursor.execute(
+        "INSERT OR IGNORE INTO sync_cursors (url, acked_seq) VALUES (?, 0)", (url,)
+    )
+    cursor.execute(
+        "UPDATE sync_cursors SET acked_seq = ?, updated_at = ? WHERE url = ? AND acked_seq >= ? AND acked_seq < ?",
+        (upto_seq, now_text(), url, after_seq, upto_seq)
+    )
+
+
+def get_job(job_id):
+    with database.pooled() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("SELECT * FROM sync_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+# Claim up to limit due batches for sending. Returns the batches and how long to
+# wait before the next one falls due.
+def claim_due_batches(limit):
+    now = time.time()
+    with database.pooled() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("""
+                SELECT o.id, o.job_id, o.first_seq, o.last_seq, o.attempts, j.url, j.format
+                FROM sync_outbox o JOIN sync_jobs j ON j.id = o.job_id
+                WHERE o.status IN ('pending', 'sending') AND o.next_attempt_at <= ?
+                ORDER BY o.next_attempt_at, o.id
+                LIMIT ?
+            """, (now, limit))
+            batches = [dict(row) for row in cursor.fetchall()]
+            cursor.executemany(
+                "UPDATE sync_outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                [(now + SYNC_LEASE, batch["id"]) for batch in batches]
+            )
+            cursor.execute("SELECT MIN(next_attempt_at) FROM sync_outbox WHERE status IN ('pending', 'sending')")
+            next_due = cursor.fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    delay = SYNC_IDLE_POLL if next_due is None else min(max(next_due - now, 0), SYNC_IDLE_POLL)
+    return batches, delay
+
+
+# Current state of the records changed in the batch's range: live records by id,
+# and the ids of records deleted since
+def load_batch_changes(batch):
+    users = {}
+    deleted = []
+    with database.pooled() as conn:
+        cursor = conn.execute(
+            f"""
+            SELECT c.record_id, u.deleted_at IS NULL AND u.rowid IS NOT NULL, {', '.join('u.' + f for f in USER_FIELDS)}
+            FROM record_changes c LEFT JOIN users u ON u.rowid = c.record_id
+            WHERE c.seq BETWEEN ? AND ?
+            """,
+            (batch["first_seq"], batch["last_seq"])
+        )
+        for row in cursor:
+            if row[1]:
+                users[str(row[0])] = dict(zip(USER_FIELDS, database.from_db_values(row[2:])))
+            else:
+                deleted.append(row[0])
+    return users, deleted
+
+
+# Every live record, for a FORM_FORMAT send
+def load_all_records():
+    with database.pooled() as conn:
+        cursor = conn.execute(f"SELECT rowid, {', '.join(USER_FIELDS)} FROM users WHERE {database.LIVE_SQL}")
+        return {str(row[0]): dict(zip(USER_FIELDS, database.from_db_values(row[1:]))) for row in cursor}
+
+
+_local = threading.local()
+
+
+# One keep-alive session per sender thread
+def http_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+# A 2xx answer that does not acknowledge the batch: the destination does not speak
+# BATCH_FORMAT, and retrying will not change that
+class NotAcknowledged(Exception):
+    pass
+
+
+def post_form(batch):
+    users = load_all_records()
+    response = http_session().post(
+        batch["url"], data={"data": codec.dumps(users).decode("utf-8")}, timeout=SYNC_TIMEOUT
+    )
+    response.raise_for_status()
+    logger.debug(f"Sync job {batch['job_id']}: {batch['url']} answered {response.status_code}: {response.text[:200]}")
+    return len(users), 0
+
+
+def post_batch(batch):
+    users, deleted = load_batch_changes(batch)
+    body = codec.dumps({"job_id": batch["job_id"], "batch_id": batch["id"], "users": users, "deleted": deleted})
+    response = http_session().post(
+        batch["url"],
+        data=codec.compress(body, "gzip"),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        timeout=SYNC_TIMEOUT
+    )
+    response.raise_for_status()
+    try:
+        acked = codec.loads(response.content).get("batch_id") == batch["id"]
+    except (ValueError, AttributeError):
+        acked = False
+    if not acked:
+        raise NotAcknowledged(f"HTTP {response.status_code} without an acknowledgement of batch {batch['id']}")
+    return len(users), len(deleted)
+
+
+def send_batch(batch):
+    try:
+        if batch["format"] == FORM_FORMAT:
+            records, deleted = post_form(batch)
+        else:
+            records, deleted = post_batch(batch)
+    except NotAcknowledged as e:
+        batch_failed(batch, str(e), retry=False)
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        batch_failed(batch, f"HTTP {status}", retry=status >= 500 or status in RETRYABLE_STATUSES)
+    except (requests.RequestException, sqlite3.Error) as e:
+        batch_failed(batch, str(e))
+    except Exception as e:
+        # Anything else (a record that cannot be serialized, a bug) will fail the
+        # same way again, so the job is failed rather than left 'sending' forever
+        logger.exception(f"Sync job {batch['job_id']}: batch {batch['id']} could not be sent")
+        batch_failed(batch, f"{type(e).__name__}: {e}", retry=False)
+    else:
+        batch_sent(batch, records, deleted)
+
+
+def batch_sent(batch, records, deleted):
+    with database.pooled() as conn:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE sync_outbox SET status = 'sent', last_error = NULL WHERE id = ?", (batch["id"],))
+            cursor.execute(
+                "UPDATE sync_jobs SET batches_sent = batches_sent + 1 WHERE id = ?", (batch["job_id"],)
+            )
+            cursor.execute("SELECT batches_sent = batches FROM sync_jobs WHERE id = ?", (batch["job_id"],))
+            if cursor.fetchone()[0]:
+                finish_job(cursor, batch["job_id"])
+    logger.debug(
+        f"Sync job {batch['job_id']}: batch {batch['id']} sent with {records} records and {deleted} deletions"
+    )
+
+
+def backoff_delay(attempts):
+    delay = min(SYNC_BACKOFF_MAX, SYNC_BACKOFF_BASE * 2 ** (attempts - 1))
+    # Jitter keeps batches that failed together from retrying together
+    return delay * random.uniform(0.5, 1)
+
+
+def batch_failed(batch, error, retry=True):
+    attempts = batch["attempts"] + 1
+    with database.pooled() as conn:
+        with conn:
+            if retry and attempts < SYNC_MAX_ATTEMPTS:
+                delay = backoff_delay(attempts)
+                conn.execute(
+                    "UPDATE sync_outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? "
+                    "WHERE id = ?",
+                    (attempts, time.time() + delay, error, batch["id"])
+                )
+                logger.warning(
+                    f"Sync job {batch['job_id']}: batch {batch['id']} failed ({error}), "
+                    f"retry {attempts} in {delay:.0f}s"
+                )
+                return
+            conn.execute(
+                "UPDATE sync_outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, batch["id"])
+            )
+            conn.execute(
+                "UPDATE sync_jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ?",
+                (now_text(), error, batch["job_id"])
+            )
+    logger.error(f"Sync job {batch['job_id']}: batch {batch['id']} failed after {attempts} attempts ({error})")
+
+
+# Background sender. One dispatcher thread claims due batches from the outbox and
+# hands them to at most `concurrency` sender threads. Queued work survives
+# restarts; whatever was in flight is claimed again once its lease runs out.
+class SyncWorker:
+    def __init__(self, concurrency=SYNC_CONCURRENCY):
+        self.concurrency = concurrency
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="sync-outbox", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    # Stop claiming batches and wait for the ones in flight
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+            self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sync-send") as executor:
+            while not self._stop.is_set():
+                self._wake.clear()
+                delay = SYNC_IDLE_POLL
+                free = self.concurrency - len(in_flight)
+                if free > 0:
+                    try:
+                        batches, delay = claim_due_batches(free)
+                        for batch in batches:
+                            in_flight.add(executor.submit(send_batch, batch))
+                    except sqlite3.Error as e:
+                        logger.warning(f"Could not read the sync outbox: {e}")
+                if in_flight:
+                    done, in_flight = wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception():
+                            logger.error(f"Sync sender crashed: {future.exception()}")
+                else:
+                    self._wake.wait(delay)
+
+
+worker = SyncWorker()
@@ -0,0 +1,84 @@
+# Migrates legacy users tables with writes landing between the chunks of the online
+# copy, and checks that every live record ends up in the change log that delta
+# syncs read.
+#
+#   python -m pytest tests
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from database import USER_FIELDS
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "user_data.db")
+    monkeypatch.setattr(database, "DB_PATH", path)
+    # The test drives the copy itself, chunk by chunk
+    monkeypatch.setattr(database, "start_background_migration", lambda: None)
+    return path
+
+
+# A legacy all-TEXT users table: app.py's (integer ids) or the shipped database's
+# (TEXT ids holding UUIDs)
+def create_legacy_table(path, id_type, ids):
+    conn = sqlite3.connect(path)
+    columns = ", ".join(f"{field} TEXT" for field in USER_FIELDS)
+    conn.execute(f"CREATE TABLE users (id {id_type} PRIMARY KEY, {columns})")
+    conn.executemany(
+        "INSERT INTO users (id, string_serial_number, report_uniq_id_uid, start_date) VALUES (?, ?, ?, ?)",
+        [(record_id, "S1", f"R{n}", "01/02/2025") for n, record_id in enumerate(ids, 1)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def insert_record(conn, uid):
+    conn.execute(
+        "INSERT INTO users (string_serial_number, report_uniq_id_uid, start_date) VALUES (?, ?, ?)",
+        ("S1", uid, "01/02/2025")
+    )
+    conn.commit()
+
+
+def assert_every_live_record_tracked(conn):
+    assert database.get_schema_version(conn.cursor()) == database.SCHEMA_VERSION
+    live = {row[0] for row in conn.execute(f"SELECT rowid FROM users WHERE {database.LIVE_SQL}")}
+    tracked = {row[0] for row in conn.execute("SELECT record_id FROM record_changes")}
+    assert live
+    assert live <= tracked
+
+
+@pytest.mark.parametrize("id_type, ids", [
+    ("INTEGER", [1, 2, 3, 4]),
+    ("TEXT", ["1", "05c2eea6-35ad-46bb-8e82-30c9bda519a1", "9b1f", "c3d4"]),
+])
+def test_writes_during_migration_are_tracked(db_path, id_type, ids):
+    create_legacy_table(db_path, id_type, ids)
+    assert database.init_db() is True
+
+    conn = database.connect()
+    try:
+        assert database.migrate_typed_chunk(conn, chunk_size=1)
+        conn.execute("UPDATE users SET mask = 'changed' WHERE rowid = 1")
+        conn.commit()
+        insert_record(conn, "R5")
+        assert database.migrate_typed_chunk(conn, chunk_size=1)
+        insert_record(conn, "R6")
+        stamp = database.soft_delete_records(conn, [2])
+        database.restore_records(conn, [2], stamp)
+        database.soft_delete_records(conn, [3])
+        while database.migrate_typed_chunk(conn, chunk_size=1):
+            pass
+
+        assert_every_live_record_tracked(conn)
+        # Record ids survive the swap, and the deleted record remains as a tombstone
+        assert [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")] == [1, 2, 3, 4, 5, 6]
+        assert conn.execute("SELECT 1 FROM record_changes WHERE record_id = 3").fetchone()
+    finally:
+        conn.close()
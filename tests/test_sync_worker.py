@@ -0,0 +1,114 @@
+# Runs the sync worker against the post_data.py stand-ins for both body formats.
+#
+#   python -m pytest tests
+import os
+import sys
+import threading
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import post_data
+import sync_worker
+from database import USER_FIELDS
+
+
+@pytest.fixture
+def receiver(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "user_data.db"))
+    database.pool.close_all()
+    database.init_db(background=False)
+    post_data.received.clear()
+
+    server = make_server("127.0.0.1", 0, post_data.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    sync_worker.worker.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    sync_worker.worker.stop(timeout=10)
+    server.shutdown()
+    database.pool.close_all()
+
+
+def insert_records(count):
+    conn = database.connect()
+    with conn:
+        conn.executemany(
+            f"INSERT INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' for _ in USER_FIELDS)})",
+            [
+                database.to_db_values({"string_serial_number": "S1", "report_uniq_id_uid": f"R{n}",
+                                       "start_date": "01/02/2025", "leak": "24"})
+                for n in range(count)
+            ]
+        )
+    conn.close()
+
+
+def wait_for_job(job):
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        job = sync_worker.get_job(job["id"])
+        if job["status"] != "pending":
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Sync job {job['id']} did not finish")
+
+
+def acked_seq(url):
+    with database.pooled() as conn:
+        row = conn.execute("SELECT acked_seq FROM sync_cursors WHERE url = ?", (url,)).fetchone()
+    return row[0] if row else None
+
+
+def test_batch_format_sends_changes_since_the_last_acknowledgement(receiver):
+    url = receiver + "/sync"
+    insert_records(3)
+    job = wait_for_job(sync_worker.enqueue_sync(url))
+    assert (job["status"], job["format"], job["records"]) == ("done", "batch", 3)
+    assert sorted(post_data.received) == ["1", "2", "3"]
+    assert acked_seq(url) == job["upto_seq"]
+
+    conn = database.connect()
+    with conn:
+        conn.execute("UPDATE users SET mask = 'Nasal' WHERE rowid = 1")
+    database.soft_delete_records(conn, [2])
+    conn.close()
+    job = wait_for_job(sync_worker.enqueue_sync(url))
+    assert (job["status"], job["records"]) == ("done", 2)
+    assert sorted(post_data.received) == ["1", "3"]
+    assert post_data.received["1"]["mask"] == "Nasal"
+    assert acked_seq(url) == job["upto_seq"]
+
+
+def test_form_format_sends_every_record_without_advancing_the_cursor(receiver):
+    assert sync_worker.destination_format(sync_worker.LEGACY_SYNC_URL) == sync_worker.FORM_FORMAT
+    url = receiver + "/form"
+    insert_records(3)
+    for _ in range(2):
+        job = wait_for_job(sync_worker.enqueue_sync(url, body_format=sync_worker.FORM_FORMAT))
+        assert (job["status"], job["records"], job["batches"]) == ("done", 3, 1)
+        assert sorted(post_data.received) == ["1", "2", "3"]
+        assert post_data.received["1"]["leak"] == "24"
+    assert acked_seq(url) is None
+
+
+def test_unacknowledged_batch_fails_the_job(receiver):
+    # Answers 200 to any post without acknowledging the batch
+    app = Flask(__name__)
+    app.add_url_rule("/", "ok", lambda: {"status": "success"}, methods=["POST"])
+    server = make_server("127.0.0.1", 0, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        insert_records(1)
+        job = wait_for_job(sync_worker.enqueue_sync(url, body_format=sync_worker.BATCH_FORMAT))
+        assert job["status"] == "failed"
+        assert "acknowledgement" in job["last_error"]
+        assert acked_seq(url) is None
+    finally:
+        server.shutdown()
@@ -2,191 +2,33 @@ import sys
 import sqlite3
 import datetime
 import re
-from uuid import uuid4
+import database
+from database import USER_FIELDS
 from PyQt5.QtWidgets import (
     QApplication, QDialog, QVBoxLayout, QFormLayout, QHBoxLayout,
-    QLineEdit, QPushButton, QLabel, QTableWidget, QTableWidgetItem,
-    QMessageBox, QHeaderView, QAbstractItemView, QScrollArea, QWidget, QCheckBox,QComboBox
+    QLineEdit, QPushButton, QLabel, QTableView,
+    QMessageBox, QHeaderView, QAbstractItemView, QScrollArea, QWidget, QCheckBox,QComboBox,
+    QStyledItemDelegate, QStyleOptionViewItem, QStyle, QShortcut
 )
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor, QBrush
+from PyQt5.QtCore import (
+    Qt, QAbstractTableModel, QSortFilterProxyModel, QModelIndex, QObject, QRunnable, QThreadPool,
+    QTimer, QEvent, QRect, QSize, QSettings, pyqtSignal
+)
+from PyQt5.QtGui import QColor, QPainter, QPalette, QKeySequence
 
 # ----------------- Database Init -----------------
+# The schema lives in database.py, shared with the Flask server. A legacy
+# all-TEXT table is migrated to the typed layout in the background; record
+# handles in this module are rowids, which stay valid across that migration.
 def init_db():
     try:
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
-
-        # Create table with id as TEXT
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                string_serial_number TEXT,
-                report_uniq_id_uid TEXT,
-                device_user_id TEXT,
-                device_reading TEXT,
-                start_date TEXT,
-                end_date TEXT,
-                mask TEXT,
-                mask_type TEXT,
-                start_hour_min TEXT,
-                end_hour_min TEXT,
-                timedifferenceinMinute TEXT,
-                reading_dev_mode TEXT,
-                mode_name TEXT,
-                device_name TEXT,
-                csa_count TEXT,
-                osa_count TEXT,
-                hsa_count TEXT,
-                a_flex TEXT,
-                a_flex_level TEXT,
-                a_flex_value TEXT,
-                leak TEXT,
-                max_pressure TEXT,
-                min_pressure TEXT,
-                pressurechangecount TEXT,
-                ratechangeFactor TEXT,
-                final_date TEXT,
-                date_time TEXT,
-                old_or_new TEXT
-            )
-        ''')
-
-        # Verify table schema
-        cursor.execute("PRAGMA table_info(users)")
-        cols = [c[1] for c in cursor.fetchall()]
-        expected_cols = [
-            'id', 'string_serial_number', 'report_uniq_id_uid', 'device_user_id', 'device_reading',
-            'start_date', 'end_date', 'mask', 'mask_type', 'start_hour_min', 'end_hour_min',
-            'timedifferenceinMinute', 'reading_dev_mode', 'mode_name', 'device_name',
-            'csa_count', 'osa_count', 'hsa_count', 'a_flex', 'a_flex_level', 'a_flex_value',
-            'leak', 'max_pressure', 'min_pressure', 'pressurechangecount', 'ratechangeFactor',
-            'final_date', 'date_time', 'old_or_new'
-        ]
-        if set(cols) != set(expected_cols):
-            print("Table schema incorrect. Recreating table.")
-            cursor.execute("DROP TABLE IF EXISTS users")
-            cursor.execute('''
-                CREATE TABLE users (
-                    id TEXT PRIMARY KEY,
-                    string_serial_number TEXT,
-                    report_uniq_id_uid TEXT,
-                    device_user_id TEXT,
-                    device_reading TEXT,
-                    start_date TEXT,
-                    end_date TEXT,
-                    mask TEXT,
-                    mask_type TEXT,
-                    start_hour_min TEXT,
-                    end_hour_min TEXT,
-                    timedifferenceinMinute TEXT,
-                    reading_dev_mode TEXT,
-                    mode_name TEXT,
-                    device_name TEXT,
-                    csa_count TEXT,
-                    osa_count TEXT,
-                    hsa_count TEXT,
-                    a_flex TEXT,
-                    a_flex_level TEXT,
-                    a_flex_value TEXT,
-                    leak TEXT,
-                    max_pressure TEXT,
-                    min_pressure TEXT,
-                    pressurechangecount TEXT,
-                    ratechangeFactor TEXT,
-                    final_date TEXT,
-                    date_time TEXT,
-                    old_or_new TEXT
-                )
-            ''')
-
-        conn.commit()
+        database.init_db()
     except Exception as e:
         print(f"Database initialization error: {str(e)}")
         raise
-    finally:
-        conn.close()
-
-# Migrate existing data to new schema (if needed)
-def migrate_db():
-    try:
-        conn = sqlite3.connect("user_data.db")
-        cursor = conn.cursor()
-
-        # Check if old table with INTEGER id exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if cursor.fetchone():
-            cursor.execute("PRAGMA table_info(users)")
-            cols = [c[1] for c in cursor.fetchall()]
-            if 'id' in cols:
-                cursor.execute("SELECT type FROM pragma_table_info('users') WHERE name='id'")
-                id_type = cursor.fetchone()[0]
-                if id_type == 'INTEGER':
-                    # Create new table with id as TEXT
-                    cursor.execute('''
-                        CREATE TABLE users_new (
-                            id TEXT PRIMARY KEY,
-                            string_serial_number TEXT,
-                            report_uniq_id_uid TEXT,
-                            device_user_id TEXT,
-                            device_reading TEXT,
-                            start_date TEXT,
-                            end_date TEXT,
-                            mask TEXT,
-                            mask_type TEXT,
-                            start_hour_min TEXT,
-                            end_hour_min TEXT,
-                            timedifferenceinMinute TEXT,
-                            reading_dev_mode TEXT,
-                            mode_name TEXT,
-                            device_name TEXT,
-                            csa_count TEXT,
-                            osa_count TEXT,
-                            hsa_count TEXT,
-                            a_flex TEXT,
-                            a_flex_level TEXT,
-                            a_flex_value TEXT,
-                            leak TEXT,
-                            max_pressure TEXT,
-                            min_pressure TEXT,
-                            pressurechangecount TEXT,
-                            ratechangeFactor TEXT,
-                            final_date TEXT,
-                            date_time TEXT,
-                            old_or_new TEXT
-                        )
-                    ''')
-
-                    # Copy data, converting id to string
-                    cursor.execute("SELECT * FROM users")
-                    rows = cursor.fetchall()
-                    for row in rows:
-                        cursor.execute('''
-                            INSERT INTO users_new (
-                                id, string_serial_number, report_uniq_id_uid, device_user_id, device_reading,
-                                start_date, end_date, mask, mask_type, start_hour_min, end_hour_min,
-                                timedifferenceinMinute, reading_dev_mode, mode_name, device_name,
-                                csa_count, osa_count, hsa_count, a_flex, a_flex_level, a_flex_value,
-                                leak, max_pressure, min_pressure, pressurechangecount, ratechangeFactor,
-                                final_date, date_time, old_or_new
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (str(row[0]),) + row[1:])
-
-                    # Drop old table and rename new table
-                    cursor.execute("DROP TABLE users")
-                    cursor.execute("ALTER TABLE users_new RENAME TO users")
-                    conn.commit()
-                    print("Database migration completed: id converted to TEXT")
-        conn.close()
-    except Exception as e:
-        print(f"Database migration error: {str(e)}")
-        raise
-    finally:
-        conn.close()
 
-# Call init and migration at program start
+# Call init at program start
 init_db()
-migrate_db()
 
 # ----------------- Add/Edit User Dialog -----------------
 class UserDetailsDialog(QDialog):
@@ -255,11 +97,11 @@ class UserDetailsDialog(QDialog):
         self.a_flex_value = QLineEdit()
         self.a_flex_value.setPlaceholderText("e.g., 1.5")
         self.leak = QLineEdit()
-        self.leak.setPlaceholderText("e.g., 24 L/min")
+        self.leak.setPlaceholderText("e.g., 24")
         self.max_pressure = QLineEdit()
-        self.max_pressure.setPlaceholderText("e.g., 20 cmH2O")
+        self.max_pressure.setPlaceholderText("e.g., 20")
         self.min_pressure = QLineEdit()
-        self.min_pressure.setPlaceholderText("e.g., 4 cmH2O")
+        self.min_pressure.setPlaceholderText("e.g., 4")
         self.pressurechangecount = QLineEdit()
         self.pressurechangecount.setPlaceholderText("e.g., 15")
         self.ratechangeFactor = QLineEdit()
@@ -445,9 +287,14 @@ class UserDetailsDialog(QDialog):
         if user_data['date_time'] and not self.validate_datetime(user_data['date_time']):
             QMessageBox.warning(self, "Warning", "Valid Date & Time (DD/MM/YYYY HH:MM) is required.")
             return
+        try:
+            values = database.to_db_values(user_data)
+        except ValueError as e:
+            QMessageBox.warning(self, "Warning", f"Invalid number: {e}.")
+            return
 
         try:
-            conn = sqlite3.connect("user_data.db")
+            conn = database.connect()
             cursor = conn.cursor()
 
             # Verify table exists
@@ -456,31 +303,32 @@ class UserDetailsDialog(QDialog):
                 raise Exception("Table 'users' does not exist.")
 
             if self.mode == "add":
-                # Generate a unique string ID
-                user_id = str(uuid4())
+                # Saving a report that is already stored for this device
+                # updates it instead of duplicating it
                 cursor.execute('''
                     INSERT INTO users (
-                        id, string_serial_number, report_uniq_id_uid, device_user_id, device_reading,
+                        string_serial_number, report_uniq_id_uid, device_user_id, device_reading,
                         start_date, end_date, mask, mask_type, start_hour_min, end_hour_min,
                         timedifferenceinMinute, reading_dev_mode, mode_name, device_name,
                         csa_count, osa_count, hsa_count, a_flex, a_flex_level, a_flex_value,
                         leak, max_pressure, min_pressure, pressurechangecount, ratechangeFactor,
                         final_date, date_time, old_or_new
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user_id,
-                    user_data['string_serial_number'], user_data['report_uniq_id_uid'],
-                    user_data['device_user_id'], user_data['device_reading'],
-                    user_data['start_date'], user_data['end_date'], user_data['mask'],
-                    user_data['mask_type'], user_data['start_hour_min'], user_data['end_hour_min'],
-                    user_data['timedifferenceinMinute'], user_data['reading_dev_mode'],
-                    user_data['mode_name'], user_data['device_name'], user_data['csa_count'],
-                    user_data['osa_count'], user_data['hsa_count'], user_data['a_flex'],
-                    user_data['a_flex_level'], user_data['a_flex_value'], user_data['leak'],
-                    user_data['max_pressure'], user_data['min_pressure'],
-                    user_data['pressurechangecount'], user_data['ratechangeFactor'],
-                    user_data['final_date'], user_data['date_time'], user_data['old_or_new']
-                ))
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (string_serial_number, report_uniq_id_uid) WHERE report_uniq_id_uid <> ''
+                    DO UPDATE SET
+                        device_user_id=excluded.device_user_id, device_reading=excluded.device_reading,
+                        start_date=excluded.start_date, end_date=excluded.end_date, mask=excluded.mask,
+                        mask_type=excluded.mask_type, start_hour_min=excluded.start_hour_min,
+                        end_hour_min=excluded.end_hour_min, timedifferenceinMinute=excluded.timedifferenceinMinute,
+                        reading_dev_mode=excluded.reading_dev_mode, mode_name=excluded.mode_name,
+                        device_name=excluded.device_name, csa_count=excluded.csa_count,
+                        osa_count=excluded.osa_count, hsa_count=excluded.hsa_count, a_flex=excluded.a_flex,
+                        a_flex_level=excluded.a_flex_level, a_flex_value=excluded.a_flex_value,
+                        leak=excluded.leak, max_pressure=excluded.max_pressure,
+                        min_pressure=excluded.min_pressure, pressurechangecount=excluded.pressurechangecount,
+                        ratechangeFactor=excluded.ratechangeFactor, final_date=excluded.final_date,
+                        date_time=excluded.date_time, old_or_new=excluded.old_or_new, deleted_at=NULL
+                ''', values)
             else:
                 cursor.execute('''
                     UPDATE users SET
@@ -491,21 +339,8 @@ class UserDetailsDialog(QDialog):
                         osa_count=?, hsa_count=?, a_flex=?, a_flex_level=?, a_flex_value=?,
                         leak=?, max_pressure=?, min_pressure=?, pressurechangecount=?,
                         ratechangeFactor=?, final_date=?, date_time=?, old_or_new=?
-                    WHERE id=?
-                ''', (
-                    user_data['string_serial_number'], user_data['report_uniq_id_uid'],
-                    user_data['device_user_id'], user_data['device_reading'],
-                    user_data['start_date'], user_data['end_date'], user_data['mask'],
-                    user_data['mask_type'], user_data['start_hour_min'], user_data['end_hour_min'],
-                    user_data['timedifferenceinMinute'], user_data['reading_dev_mode'],
-                    user_data['mode_name'], user_data['device_name'], user_data['csa_count'],
-                    user_data['osa_count'], user_data['hsa_count'], user_data['a_flex'],
-                    user_data['a_flex_level'], user_data['a_flex_value'], user_data['leak'],
-                    user_data['max_pressure'], user_data['min_pressure'],
-                    user_data['pressurechangecount'], user_data['ratechangeFactor'],
-                    user_data['final_date'], user_data['date_time'], user_data['old_or_new'],
-                    self.user_data['id']
-                ))
+                    WHERE rowid=?
+                ''', values + (self.user_data['id'],))
 
             conn.commit()
             QMessageBox.information(self, "Success", "Device record saved successfully.")
@@ -762,16 +597,453 @@ class ColumnSelectorDialog(QDialog):
             }
         """
 
+# ----------------- Records Table Model -----------------
+# Column 0 is the hidden rowid, columns 1-28 follow USER_FIELDS, the last one is the delete action
+COLUMN_LABELS = [
+    "ID", "Serial Number", "Report UID", "User ID", "Device Reading",
+    "Start Date", "End Date", "Mask", "Mask Type", "Start Time",
+    "End Time", "Time Diff (min)", "Device Mode", "Mode Name", "Device Name",
+    "CSA Count", "OSA Count", "HSA Count", "A-Flex", "A-Flex Level",
+    "A-Flex Value", "Leak", "Max Pressure", "Min Pressure", "Pressure Changes",
+    "Rate Change Factor", "Final Date", "Date & Time", "Old/New", "Action"
+]
+ACTION_COLUMN = 29
+
+class CancelToken:
+    """Handed to a background load; once cancelled its results are dropped and its query interrupted."""
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class PageLoaderSignals(QObject):
+    loaded = pyqtSignal(object, list)
+    failed = pyqtSignal(object, str)
+
+class PageLoader(QRunnable):
+    """Runs one page query off the GUI thread and converts the rows to display strings.
+    The query selects rowid, the sort key and then the given fields; columns that were
+    not selected are left blank in the table row."""
+    # sqlite VM steps between checks of the cancel token
+    CANCEL_CHECK_STEPS = 1000
+
+    def __init__(self, sql, params, fields, token):
+        super().__init__()
+        self.sql = sql
+        self.params = params
+        self.columns = [(USER_FIELDS.index(field) + 1, field) for field in fields]
+        self.token = token
+        self.signals = PageLoaderSignals()
+
+    def table_row(self, row):
+        values = [str(row[0])] + [""] * len(USER_FIELDS)
+        for (col, field), value in zip(self.columns, row[2:]):
+            values[col] = database.from_db_value(field, value)
+        return values
+
+    def run(self):
+        if self.token.cancelled:
+            return
+        try:
+            conn = database.connect()
+            try:
+                conn.set_progress_handler(lambda: self.token.cancelled, self.CANCEL_CHECK_STEPS)
+                cursor = conn.cursor()
+                cursor.execute(self.sql, self.params)
+                page = [(row[1], self.table_row(row)) for row in cursor]
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            if not self.token.cancelled:
+                self.signals.failed.emit(self.token, str(e))
+            return
+        self.signals.loaded.emit(self.token, page)
+
+class RecordsTableModel(QAbstractTableModel):
+    """Device records, newest first. Pages are read from sqlite on the thread pool as
+    the view scrolls, and appended when they arrive so the GUI thread never waits."""
+    PAGE_SIZE = 200
+    load_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.clauses = []
+        self.params = []
+        self.match = None
+        self.fields = list(USER_FIELDS)  # columns selected from sqlite
+        self.loaded_fields = set(self.fields)  # columns present in every loaded row
+        self.rows = []
+        self.last_key = None  # (sort key, rowid) of the last loaded row
+        self.has_more = True
+        self.loader = None  # page load in flight
+        self.token = None
+
+    def set_filter(self, clauses, params, match=None):
+        """Show only records matching the SQL clauses, starting again from the first page.
+        With an FTS5 match query the records come best match first instead of newest first."""
+        self.cancel()
+        self.beginResetModel()
+        self.clauses = list(clauses)
+        self.params = list(params)
+        self.match = match
+        self.loaded_fields = set(self.fields)
+        self.rows = []
+        self.last_key = None
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def reload(self):
+        self.set_filter(self.clauses, self.params, self.match)
+
+    def set_fields(self, fields):
+        """Select only these columns from now on. Hiding columns keeps the loaded rows;
+        showing a column that was not loaded reloads them. The searched columns are
+        always selected, so RecordsFilterProxy can match hidden ones too."""
+        self.fields = [field for field in USER_FIELDS if field in fields or field in database.FTS_FIELDS]
+        if not self.loaded_fields.issuperset(self.fields):
+            self.reload()
+
+    def cancel(self):
+        """Drop the page load in flight; the next fetchMore asks for the same page again."""
+        if self.token:
+            self.token.cancel()
+        self.loader = None
+        self.token = None
+
+    def is_loading(self):
+        return self.loader is not None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_LABELS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and self.loader is None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        clauses = [database.LIVE_SQL] + self.clauses
+        params = list(self.params)
+        if self.match:
+            # Ranked full-text matches; bm25 rank is lower for better matches
+            source = (
+                "users JOIN (SELECT rowid AS match_id, rank AS match_rank FROM users_fts "
+                "WHERE users_fts MATCH ?) ON users.rowid = match_id"
+            )
+            params.insert(0, self.match)
+            sort_key, order, after = "match_rank", "ASC", ">"
+        else:
+            source = "users"
+            sort_key, order, after = "session_start", "DESC", "<"
+        if self.last_key:
+            # Keyset paging: continue past the last loaded row, through the session_start
+            # index when listing by date
+            if not self.match:
+                clauses.append(f"{sort_key} <= ?")
+                params.append(self.last_key[0])
+            clauses.append(f"({sort_key}, users.rowid) {after} (?, ?)")
+            params += [self.last_key[0], self.last_key[1]]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT users.rowid, {', '.join([sort_key] + self.fields)} FROM {source} {where} "
+            f"ORDER BY {sort_key} {order}, users.rowid {order} LIMIT ?"
+        )
+        self.token = CancelToken()
+        self.loader = PageLoader(sql, params + [self.PAGE_SIZE], self.fields, self.token)
+        self.loaded_fields.intersection_update(self.fields)
+        self.loader.signals.loaded.connect(self.on_page_loaded)
+        self.loader.signals.failed.connect(self.on_page_failed)
+        QThreadPool.globalInstance().start(self.loader)
+
+    def on_page_loaded(self, token, page):
+        if token is not self.token:
+            return  # results of a cancelled load
+        self.loader = None
+        self.token = None
+        self.has_more = len(page) == self.PAGE_SIZE
+        if not page:
+            return
+        last_rowid = page[-1][1][0]
+        self.last_key = (page[-1][0], int(last_rowid))
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(row for _, row in page)
+        self.endInsertRows()
+
+    def on_page_failed(self, token, message):
+        if token is not self.token:
+            return
+        self.loader = None
+        self.token = None
+        self.has_more = False
+        self.load_failed.emit(message)
+
+    def remove_rows(self, rows):
+        """Drop rows from the table without reloading, one contiguous block at a time."""
+        blocks = []
+        for row in sorted(set(rows), reverse=True):
+            if blocks and blocks[-1][0] == row + 1:
+                blocks[-1][0] = row
+            else:
+                blocks.append([row, row])
+        # Highest block first, so the positions of the remaining blocks stay valid
+        for first, last in blocks:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.column() == ACTION_COLUMN:
+            # The delete button itself is painted by RecordsDelegate
+            return "Delete record" if role == Qt.ToolTipRole else None
+        if role == Qt.DisplayRole:
+            return self.rows[index.row()][index.column()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMN_LABELS[section]
+        return None
+
+    def record(self, row):
+        """The record shown in a row, as the id plus USER_FIELDS display strings
+        (blank for columns that were not loaded)."""
+        return dict(zip(["id"] + USER_FIELDS, self.rows[row]))
+
+    def full_record(self, row):
+        """The complete record of a row, read from sqlite."""
+        conn = database.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT rowid, {', '.join(USER_FIELDS)} FROM users WHERE rowid = ? AND {database.LIVE_SQL}",
+                (self.rows[row][0],)
+            )
+            stored = cursor.fetchone()
+        finally:
+            conn.close()
+        if stored is None:
+            return None
+        return dict(zip(["id"] + USER_FIELDS, [str(stored[0])] + database.from_db_values(stored[1:])))
+
+class RecordsFilterProxy(QSortFilterProxyModel):
+    """Narrows the rows RecordsTableModel has already loaded as the user types, without
+    going back to sqlite. It matches the way pressing Enter searches the database: only
+    the database.FTS_FIELDS columns, and every word must start a token (the FTS5 match
+    query) or, without full-text search, the whole text must appear in one column (the
+    LIKE fallback). When a query refines the previous one, only the rows that matched
+    before are scanned again."""
+    SEARCH_COLUMNS = [USER_FIELDS.index(field) + 1 for field in database.FTS_FIELDS]
+
+    def __init__(self, parent=None, use_fts=True):
+        super().__init__(parent)
+        self.use_fts = use_fts
+        self.words = []
+        self.phrases = []  # token list of each word
+        self.matches = None  # source rows matching self.words among the first self.scanned
+        self.scanned = 0
+        self.haystacks = {}  # source row -> tokens (or lowercased text) of each search column
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        model.modelReset.connect(self.forget_rows)
+        model.rowsRemoved.connect(self.rescan_rows)
+
+    def forget_rows(self):
+        self.haystacks = {}
+        self.matches = set() if self.words else None
+        self.scanned = 0
+
+    # Source rows shifted; rebuild the caches that are keyed by row
+    def rescan_rows(self):
+        self.forget_rows()
+        if self.words:
+            self.scanned = self.sourceModel().rowCount()
+            self.matches = {row for row in range(self.scanned) if self.row_matches(row)}
+
+    def row_matches(self, source_row):
+        columns = self.haystacks.get(source_row)
+        if columns is None:
+            row = self.sourceModel().rows[source_row]
+            if self.use_fts:
+                columns = [database.fts_tokens(row[col]) for col in self.SEARCH_COLUMNS]
+            else:
+                columns = [row[col].lower() for col in self.SEARCH_COLUMNS]
+            self.haystacks[source_row] = columns
+        if not self.use_fts:
+            return any(self.words[0] in value for value in columns)
+        return all(any(self.phrase_in(phrase, tokens) for tokens in columns) for phrase in self.phrases)
+
+    @staticmethod
+    def phrase_in(phrase, tokens):
+        last = len(phrase) - 1
+        return any(
+            tokens[start:start + last] == phrase[:last] and tokens[start + last].startswith(phrase[last])
+            for start in range(len(tokens) - last)
+        )
+
+    def set_query(self, text):
+        if self.use_fts:
+            words = text.lower().split()
+            # A word that has no letters or digits matches like an empty phrase: always
+            phrases = [database.fts_tokens(word) for word in words]
+            words = [word for word, phrase in zip(words, phrases) if phrase]
+            phrases = [phrase for phrase in phrases if phrase]
+        else:
+            words = [text.strip().lower()] if text.strip() else []
+            phrases = []
+        if words == self.words:
+            return
+        # Rows matching every new word also match every old word that starts one (or,
+        # for the LIKE fallback, that the new text contains)
+        if self.use_fts:
+            refines = bool(self.words) and all(any(new.startswith(old) for new in words) for old in self.words)
+        else:
+            refines = bool(self.words) and bool(words) and self.words[0] in words[0]
+        self.words = words
+        self.phrases = phrases
+        if not words:
+            self.matches = None
+            self.scanned = 0
+        elif refines and self.matches is not None:
+            self.matches = {row for row in self.matches if self.row_matches(row)}
+        else:
+            self.scanned = self.sourceModel().rowCount()
+            self.matches = {row for row in range(self.scanned) if self.row_matches(row)}
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.matches is None:
+            return True
+        if source_row < self.scanned:
+            return source_row in self.matches
+        # A row from a page loaded since the last scan
+        accepted = self.row_matches(source_row)
+        if source_row == self.scanned:
+            self.scanned += 1
+            if accepted:
+                self.matches.add(source_row)
+        return accepted
+
+class RecordsDelegate(QStyledItemDelegate):
+    """Paints the selected row and the Action column's delete button for every cell the
+    view draws, so no widget exists per row; clicks are hit-tested against the button."""
+    delete_requested = pyqtSignal(QModelIndex)
+    SELECTED_BACKGROUND = QColor("#A376A2")
+    SELECTED_TEXT = QColor("white")
+    BUTTON_COLOR = QColor("#ef4444")
+    BUTTON_HOVER_COLOR = QColor("#dc2626")
+    BUTTON_SIZE = QSize(44, 26)
+
+    def button_rect(self, cell_rect):
+        rect = QRect(cell_rect)
+        rect.setSize(self.BUTTON_SIZE.boundedTo(cell_rect.size()))
+        rect.moveCenter(cell_rect.center())
+        return rect
+
+    def paint(self, painter, option, index):
+        selected = bool(option.state & QStyle.State_Selected)
+        if selected:
+            painter.fillRect(option.rect, self.SELECTED_BACKGROUND)
+        if index.column() == ACTION_COLUMN:
+            hovered = bool(option.state & QStyle.State_MouseOver)
+            painter.save()
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.BUTTON_HOVER_COLOR if hovered else self.BUTTON_COLOR)
+            rect = self.button_rect(option.rect)
+            painter.drawRoundedRect(rect, 10, 10)
+            painter.setPen(QColor("white"))
+            painter.drawText(rect, Qt.AlignCenter, "🗑️")
+            painter.restore()
+            return
+        if selected:
+            # Draw the text over our highlight instead of the style's selection
+            option = QStyleOptionViewItem(option)
+            option.state &= ~(QStyle.State_Selected | QStyle.State_MouseOver)
+            option.palette.setColor(QPalette.Text, self.SELECTED_TEXT)
+        super().paint(painter, option, index)
+
+    def sizeHint(self, option, index):
+        if index.column() == ACTION_COLUMN:
+            return self.BUTTON_SIZE + QSize(12, 8)
+        return super().sizeHint(option, index)
+
+    def editorEvent(self, event, model, option, index):
+        if (index.column() == ACTION_COLUMN and event.type() == QEvent.MouseButtonRelease
+                and event.button() == Qt.LeftButton and self.button_rect(option.rect).contains(event.pos())):
+            self.delete_requested.emit(index)
+            return True
+        return super().editorEvent(event, model, option, index)
+
+# ----------------- Record Search -----------------
+def parse_search_date(text):
+    try:
+        day, mon, year = map(int, text.strip().split('/'))
+        return datetime.date(year, mon, day)
+    except ValueError:
+        return None
+
+# LIKE pattern matching value anywhere, case-insensitively (used with ESCAPE '\')
+def like_pattern(value):
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def build_record_filter(from_date=None, to_date=None, mode_name=None, filters=None, text=None, use_fts=True):
+    """SQL clauses, parameters and FTS5 match query for a Device Records search.
+
+    Records are matched on their indexed session_start (start date, or final date
+    when the start is missing); mode_name is an exact match on the CPAP
+    type and filters maps columns to case-insensitive substrings. Free text is
+    looked up in the full-text index (or, without one, substring-matched against
+    the same columns). The model adds the ORDER BY and page LIMIT, so a search
+    only reads the rows it shows.
+    """
+    clauses, params, match = [], [], None
+    if from_date:
+        clauses.append("session_start >= ?")
+        params.append(from_date.isoformat())
+    if to_date:
+        clauses.append("session_start < ?")
+        params.append((to_date + datetime.timedelta(days=1)).isoformat())
+    if mode_name:
+        clauses.append("mode_name = ?")
+        params.append(mode_name)
+    for field, filter_value in (filters or {}).items():
+        if filter_value and field in USER_FIELDS:
+            clauses.append(f"{field} LIKE ? ESCAPE '\\'")
+            params.append(like_pattern(filter_value))
+    if text and text.strip():
+        if use_fts:
+            match = database.fts_match_query(text)
+        else:
+            clauses.append("(" + " OR ".join(f"{field} LIKE ? ESCAPE '\\'" for field in database.FTS_FIELDS) + ")")
+            params += [like_pattern(text.strip())] * len(database.FTS_FIELDS)
+    return clauses, params, match
+
 # ----------------- View User Dialog -----------------
 class ViewUserDialog(QDialog):
-    def __init__(self, parent=None):
+    FILTER_DELAY_MS = 250
+    UNDO_TIMEOUT_MS = 10000
+
+    def __init__(self, parent=None, user_key=None):
         super().__init__(parent)
         self.setWindowTitle("Device Records")
         self.setMinimumSize(1100, 800)
         self.selected_row = -1
         self.filters = {}  # Store active filters
-        self.visible_columns = set(range(1, 29))  # Columns 1 to 28 are data columns
+        # Column choices are remembered per logged-in user
+        self.settings = QSettings("Deckmount", "CPAPApp")
+        self.columns_key = f"records_view/{user_key or 'default'}/visible_fields"
+        self.visible_columns = self.load_visible_columns()  # Columns 1 to 28 are data columns
         self.init_ui()
+        self.model.set_fields(self.visible_fields())
 
     # def init_ui(self):
     #     self.setStyleSheet(self.get_stylesheet())
@@ -843,17 +1115,30 @@ class ViewUserDialog(QDialog):
         
         add_btn = QPushButton("Add New")       
         columns_btn = QPushButton("Select Columns")
+        delete_selected_btn = QPushButton("Delete Selected")
         
         add_btn.clicked.connect(self.add_user)        
         columns_btn.clicked.connect(self.open_column_selector)
+        delete_selected_btn.clicked.connect(self.delete_selected)
         header_layout.addWidget(header)
         header_layout.addStretch()
         header_layout.addWidget(add_btn)
       
         header_layout.addWidget(columns_btn)
+        header_layout.addWidget(delete_selected_btn)
         main_layout.addLayout(header_layout)
     
         search_layout = QHBoxLayout()
+        text_label = QLabel("Search:")
+        self.search_text = QLineEdit()
+        self.search_text.setPlaceholderText("Serial, report UID, mask, mode or device")
+        self.search_text.returnPressed.connect(self.search_records)
+        # Typing narrows the loaded rows once the keystrokes pause; Enter searches the database
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(lambda: self.proxy.set_query(self.search_text.text()))
+        self.search_text.textChanged.connect(self.filter_timer.start)
         from_label = QLabel("From Date:")
         self.from_date = QLineEdit()
         self.from_date.setPlaceholderText("DD/MM/YYYY")
@@ -864,7 +1149,7 @@ class ViewUserDialog(QDialog):
         # Add CPAP Type selection
         cpap_type_label = QLabel("CPAP Type:")
         self.cpap_type_combo = QComboBox()
-        self.cpap_type_combo.addItems(["CPAP", "Auto CPAP"])
+        self.cpap_type_combo.addItems(["All", "CPAP", "Auto CPAP"])
         self.cpap_type_combo.setCurrentText("All")
         
         search_btn = QPushButton("🔍 Search")
@@ -872,6 +1157,8 @@ class ViewUserDialog(QDialog):
         search_btn.clicked.connect(self.search_records)
         clear_btn.clicked.connect(self.clear_search)
         
+        search_layout.addWidget(text_label)
+        search_layout.addWidget(self.search_text)
         search_layout.addWidget(from_label)
         search_layout.addWidget(self.from_date)
         search_layout.addWidget(to_label)
@@ -882,278 +1169,219 @@ class ViewUserDialog(QDialog):
         search_layout.addWidget(clear_btn)
         main_layout.addLayout(search_layout)
     
-        self.table = QTableWidget()
-        self.table.setColumnCount(30)  # Updated for new fields + action
-        self.table.setHorizontalHeaderLabels([
-            "ID", "Serial Number", "Report UID", "User ID", "Device Reading",
-            "Start Date", "End Date", "Mask", "Mask Type", "Start Time",
-            "End Time", "Time Diff (min)", "Device Mode", "Mode Name", "Device Name",
-            "CSA Count", "OSA Count", "HSA Count", "A-Flex", "A-Flex Level",
-            "A-Flex Value", "Leak", "Max Pressure", "Min Pressure", "Pressure Changes",
-            "Rate Change Factor", "Final Date", "Date & Time", "Old/New", "Action"
-        ])
+        try:
+            conn = database.connect()
+            self.fts_available = database.has_records_fts(conn.cursor())
+            conn.close()
+        except Exception as e:
+            print(f"Full-text search check failed: {str(e)}")
+            self.fts_available = False
+
+        self.model = RecordsTableModel(self)
+        self.model.load_failed.connect(
+            lambda message: QMessageBox.critical(self, "Error", f"Failed to load data: {message}")
+        )
+        self.proxy = RecordsFilterProxy(self, use_fts=self.fts_available)
+        self.proxy.setSourceModel(self.model)
+        self.table = QTableView()
+        self.table.setModel(self.proxy)
+        self.delegate = RecordsDelegate(self.table)
+        self.delegate.delete_requested.connect(
+            lambda index: self.delete_user(self.proxy.mapToSource(index).row())
+        )
+        self.table.setItemDelegate(self.delegate)
+        self.table.setMouseTracking(True)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.horizontalHeader().setSectionResizeMode(ACTION_COLUMN, QHeaderView.ResizeToContents)
         self.table.verticalHeader().setVisible(False)
         self.table.setAlternatingRowColors(True)
-        self.table.cellClicked.connect(self.on_cell_clicked)
-        self.table.cellDoubleClicked.connect(self.on_double_click)
+        # Handlers take rows of the source model
+        self.table.clicked.connect(
+            lambda index: self.on_cell_clicked(self.proxy.mapToSource(index).row(), index.column())
+        )
+        self.table.doubleClicked.connect(
+            lambda index: self.on_double_click(self.proxy.mapToSource(index).row(), index.column())
+        )
         self.table.setColumnHidden(0, True)
+        QShortcut(QKeySequence.Delete, self.table, self.delete_selected)
         main_layout.addWidget(self.table)
+
+        # Shown after a delete until it times out or is used
+        self.undo_bar = QWidget()
+        undo_layout = QHBoxLayout(self.undo_bar)
+        undo_layout.setContentsMargins(0, 0, 0, 0)
+        self.undo_label = QLabel()
+        undo_btn = QPushButton("Undo")
+        undo_btn.clicked.connect(self.undo_delete)
+        undo_layout.addWidget(self.undo_label)
+        undo_layout.addStretch()
+        undo_layout.addWidget(undo_btn)
+        self.undo_bar.hide()
+        self.undo_timer = QTimer(self)
+        self.undo_timer.setSingleShot(True)
+        self.undo_timer.setInterval(self.UNDO_TIMEOUT_MS)
+        self.undo_timer.timeout.connect(self.undo_bar.hide)
+        self.last_delete = None  # (rowids, deletion stamp) of the delete Undo reverts
+        main_layout.addWidget(self.undo_bar)
         self.setLayout(main_layout)
     
     def showEvent(self, event):
         self.refresh_table()
         super().showEvent(event)
 
-    def get_data_as_array(self):
-        try:
-            conn = sqlite3.connect("user_data.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users")
-            rows = cursor.fetchall()
-            conn.close()
-            # Convert to list of lists, ensuring all values are strings
-            return [[str(value) for value in row] for row in rows]
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load data: {str(e)}")
-            return []
+    def hideEvent(self, event):
+        # Nothing is painted while hidden; stop loading until the page is shown again
+        self.model.cancel()
+        super().hideEvent(event)
 
+    def load_visible_columns(self):
+        if not self.settings.contains(self.columns_key):
+            return set(range(1, 29))
+        fields = self.settings.value(self.columns_key, [], type=list)
+        return {USER_FIELDS.index(field) + 1 for field in fields if field in USER_FIELDS}
+
+    def visible_fields(self):
+        return [USER_FIELDS[col - 1] for col in sorted(self.visible_columns)]
 
     def open_column_selector(self):
         dialog = ColumnSelectorDialog(self, self.visible_columns)
         if dialog.exec_() == QDialog.Accepted:
             self.visible_columns = dialog.get_selected_columns()
-            self.refresh_table()
+            self.settings.setValue(self.columns_key, self.visible_fields())
+            # Hiding is a view change; only columns that were never loaded are queried
+            self.apply_column_visibility()
+            self.model.set_fields(self.visible_fields())
 
-    def refresh_table(self):
-        data_array = self.get_data_as_array()
-        fields = [
-            "id", "string_serial_number", "report_uniq_id_uid", "device_user_id", "device_reading",
-            "start_date", "end_date", "mask", "mask_type", "start_hour_min", "end_hour_min",
-            "timedifferenceinMinute", "reading_dev_mode", "mode_name", "device_name",
-            "csa_count", "osa_count", "hsa_count", "a_flex", "a_flex_level", "a_flex_value",
-            "leak", "max_pressure", "min_pressure", "pressurechangecount", "ratechangeFactor",
-            "final_date", "date_time", "old_or_new"
-        ]
-
-        # Apply filters
-        filtered_array = []
-        for row in data_array:
-            row_dict = dict(zip(fields, row))
-            include = True
-            for field, filter_value in self.filters.items():
-                if filter_value:
-                    if field in row_dict and filter_value.lower() not in str(row_dict[field]).lower():
-                        include = False
-                        break
-            if include:
-                filtered_array.append(row)
-
-        def parse_date_for_sort(date_str):
-            try:
-                day, mon, year = map(int, date_str.split('/'))
-                return datetime.date(year, mon, day)
-            except:
-                return datetime.date(1900, 1, 1)
-
-        filtered_array = sorted(filtered_array, key=lambda row: parse_date_for_sort(row[5] if row[5] else row[26]), reverse=True)
-
-        self.table.setRowCount(len(filtered_array))
-        for r, row in enumerate(filtered_array):
-            for c, value in enumerate(row):
-                item = QTableWidgetItem(value)
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(r, c, item)
-
-            delete_btn = QPushButton("🗑️")
-            delete_btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #ef4444;
-                    color: white;
-                    border: none;
-                    padding: 5px;
-                    border-radius: 10px;
-                }
-                QPushButton:hover {
-                    background-color: #dc2626;
-                }
-            """)
-            delete_btn.clicked.connect(lambda _, row=r: self.delete_user(row))
-            self.table.setCellWidget(r, 29, delete_btn)
-
-        self.table.horizontalHeader().setSectionResizeMode(29, QHeaderView.ResizeToContents)
-
-        # Apply column visibility
+    def apply_column_visibility(self):
         for col in range(1, 29):
             self.table.setColumnHidden(col, col not in self.visible_columns)
 
-    def search_records(self):
-        from_date_str = self.from_date.text().strip()
-        to_date_str = self.to_date.text().strip()
-
-        if not from_date_str and not to_date_str:
-            self.refresh_table()
-            return
-
-        if from_date_str and not to_date_str:
-            to_date_str = from_date_str
-        elif not from_date_str and to_date_str:
-            from_date_str = to_date_str
-
-        def parse_date(d):
-            try:
-                day, mon, year = map(int, d.split('/'))
-                return datetime.date(year, mon, day)
-            except:
-                return None
-
-        from_d = parse_date(from_date_str)
-        to_d = parse_date(to_date_str)
-
-        if from_d is None or to_d is None:
-            self.refresh_table()
-            return
+    # The record filter described by the search controls
+    def current_filter(self):
+        from_d = parse_search_date(self.from_date.text())
+        to_d = parse_search_date(self.to_date.text())
+        # A single date searches that day; an invalid or reversed range is ignored
+        from_d, to_d = from_d or to_d, to_d or from_d
+        if from_d and to_d and from_d > to_d:
+            from_d = to_d = None
+        cpap_type = self.cpap_type_combo.currentText()
+        return build_record_filter(
+            from_d, to_d,
+            mode_name=None if cpap_type == "All" else cpap_type,
+            filters=self.filters,
+            text=self.search_text.text(),
+            use_fts=self.fts_available
+        )
 
-        if from_d > to_d:
-            self.refresh_table()
-            return
-
-        data_array = self.get_data_as_array()
-        fields = [
-            "id", "string_serial_number", "report_uniq_id_uid", "device_user_id", "device_reading",
-            "start_date", "end_date", "mask", "mask_type", "start_hour_min", "end_hour_min",
-            "timedifferenceinMinute", "reading_dev_mode", "mode_name", "device_name",
-            "csa_count", "osa_count", "hsa_count", "a_flex", "a_flex_level", "a_flex_value",
-            "leak", "max_pressure", "min_pressure", "pressurechangecount", "ratechangeFactor",
-            "final_date", "date_time", "old_or_new"
-        ]
+    def refresh_table(self):
+        self.selected_row = -1
+        self.model.set_filter(*self.current_filter())
+        self.apply_column_visibility()
 
-        def parse_date_for_sort(date_str):
-            try:
-                day, mon, year = map(int, date_str.split('/'))
-                return datetime.date(year, mon, day)
-            except:
-                return datetime.date(1900, 1, 1)
-
-        filtered_array = []
-        for row in data_array:
-            row_dict = dict(zip(fields, row))
-            date_str = row_dict['start_date'] or row_dict['final_date']
-            d = parse_date(date_str)
-            if d is None:
-                continue
-            if from_d <= d <= to_d:
-                # Apply additional column filters
-                include = True
-                for field, filter_value in self.filters.items():
-                    if filter_value:
-                        if field in row_dict and filter_value.lower() not in str(row_dict[field]).lower():
-                            include = False
-                            break
-                if include:
-                    filtered_array.append(row)
-
-        filtered_array = sorted(filtered_array, key=lambda row: parse_date_for_sort(row[5] if row[5] else row[26]), reverse=True)
-
-        self.table.setRowCount(len(filtered_array))
-        for r, row in enumerate(filtered_array):
-            for c, value in enumerate(row):
-                item = QTableWidgetItem(value)
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(r, c, item)
-
-            delete_btn = QPushButton("🗑️")
-            delete_btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #ef4444;
-                    color: white;
-                    border: none;
-                    padding: 5px;
-                    border-radius: 10px;
-                }
-                QPushButton:hover {
-                    background-color: #dc2626;
-                }
-            """)
-            delete_btn.clicked.connect(lambda _, row=r: self.delete_user(row))
-            self.table.setCellWidget(r, 29, delete_btn)
-
-        # Apply column visibility
-        for col in range(1, 29):
-            self.table.setColumnHidden(col, col not in self.visible_columns)
+    def search_records(self):
+        self.filter_timer.stop()
+        self.proxy.set_query(self.search_text.text())
+        self.refresh_table()
 
     def clear_search(self):
+        self.search_text.clear()
         self.from_date.clear()
         self.to_date.clear()
+        self.cpap_type_combo.setCurrentText("All")
         self.filters = {}
-        self.refresh_table()
+        self.search_records()
 
     def on_cell_clicked(self, row, col):
-        if col == 29:
+        if col == ACTION_COLUMN:
             return
         self.selected_row = row
-        for r in range(self.table.rowCount()):
-            for c in range(self.table.columnCount()):
-                item = self.table.item(r, c)
-                if item:
-                    if r == row:
-                        item.setBackground(QBrush(QColor("#dbeafe")))
-                    else:
-                        item.setBackground(QBrush(QColor("white")))
 
     def on_double_click(self, row, col):
-        if col == 29:
+        if col == ACTION_COLUMN:
             return
         self.edit_user(row)
 
     def add_user(self):
         dialog = UserDetailsDialog(self)
         if dialog.exec_() == QDialog.Accepted:
-            self.refresh_table()
+            self.model.reload()
 
     def edit_user(self, row):
-        fields = [
-            "id", "string_serial_number", "report_uniq_id_uid", "device_user_id", "device_reading",
-            "start_date", "end_date", "mask", "mask_type", "start_hour_min", "end_hour_min",
-            "timedifferenceinMinute", "reading_dev_mode", "mode_name", "device_name",
-            "csa_count", "osa_count", "hsa_count", "a_flex", "a_flex_level", "a_flex_value",
-            "leak", "max_pressure", "min_pressure", "pressurechangecount", "ratechangeFactor",
-            "final_date", "date_time", "old_or_new"
-        ]
-        user_data = {}
-        for col in range(len(fields)):
-            item = self.table.item(row, col)
-            if item:
-                user_data[fields[col]] = item.text()
-
+        try:
+            user_data = self.model.full_record(row)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to load record: {str(e)}")
+            return
+        if user_data is None:
+            QMessageBox.warning(self, "Not Found", "This record no longer exists.")
+            self.model.reload()
+            return
         dialog = UserDetailsDialog(self, user_data, "edit")
         if dialog.exec_() == QDialog.Accepted:
-            self.refresh_table()
+            self.model.reload()
 
-    def delete_user(self, row):
-        id_item = self.table.item(row, 0)
-        if not id_item:
-            return
+    def selected_rows(self):
+        """Source model rows of the selected table rows."""
+        return sorted({self.proxy.mapToSource(index).row() for index in self.table.selectionModel().selectedRows()})
 
-        user_id = id_item.text()
-        reply = QMessageBox.question(self, 'Confirm Delete',
-                                    'Are you sure you want to delete this record?',
+    def delete_selected(self):
+        rows = self.selected_rows()
+        if rows:
+            self.delete_rows(rows)
+
+    # The delete button removes the whole selection when its row is part of it
+    def delete_user(self, row):
+        rows = self.selected_rows()
+        self.delete_rows(rows if row in rows else [row])
+
+    def delete_rows(self, rows):
+        count = len(rows)
+        question = ('Are you sure you want to delete this record?' if count == 1
+                    else f'Are you sure you want to delete these {count} records?')
+        reply = QMessageBox.question(self, 'Confirm Delete', question,
                                     QMessageBox.Yes | QMessageBox.No,
                                     QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
 
-        if reply == QMessageBox.Yes:
+        ids = [self.model.record(row)["id"] for row in rows]
+        try:
+            conn = database.connect()
             try:
-                conn = sqlite3.connect("user_data.db")
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
-                conn.commit()
+                stamp = database.soft_delete_records(conn, ids)
+            finally:
                 conn.close()
-                QMessageBox.information(self, "Success", "Record deleted successfully.")
-                self.refresh_table()
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to delete record: {str(e)}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to delete records: {str(e)}")
+            return
+
+        self.model.remove_rows(rows)
+        self.selected_row = -1
+        self.last_delete = (ids, stamp)
+        self.undo_label.setText("1 record deleted." if count == 1 else f"{count} records deleted.")
+        self.undo_bar.show()
+        self.undo_timer.start()
+
+    def undo_delete(self):
+        self.undo_timer.stop()
+        self.undo_bar.hide()
+        if not self.last_delete:
+            return
+        ids, stamp = self.last_delete
+        self.last_delete = None
+        try:
+            conn = database.connect()
+            try:
+                database.restore_records(conn, ids, stamp)
+            finally:
+                conn.close()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to restore records: {str(e)}")
+            return
+        self.model.reload()
 
     def get_stylesheet(self):
         return """
@@ -1166,7 +1394,7 @@ class ViewUserDialog(QDialog):
                 color: #1e3a8a;
                 margin-bottom: 15px;
             }
-            QTableWidget {
+            QTableView {
                 border: 1px solid #bfdbfe;
                 border-radius: 8px;
                 background: white;
@@ -1184,11 +1412,7 @@ class ViewUserDialog(QDialog):
                 border: none;
                 border-bottom: 1px solid #bfdbfe;
             }
-            QTableWidget::item:selected {
-                background: #A376A2;
-                color: white;
-            }
-            QTableWidget::item:hover {
+            QTableView::item:hover {
                 background: #c385ed;
             }
             QPushButton {
@@ -1250,6 +1474,18 @@ class ViewUserDialog(QDialog):
             QPushButton[text="Clear"]:pressed {
                 background-color: #d32f2f;
             }
+            QPushButton[text="Delete Selected"] {
+                background-color: #ef4444;
+            }
+            QPushButton[text="Delete Selected"]:hover {
+                background-color: #dc2626;
+            }
+            QPushButton[text="Undo"] {
+                background-color: #475569;
+            }
+            QPushButton[text="Undo"]:hover {
+                background-color: #334155;
+            }
             QLabel {
                 color: #1e3a8a;
                 font-weight: 600;
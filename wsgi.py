@@ -0,0 +1,78 @@
+# Production entry point for the records API.
+#
+#   python wsgi.py                      waitress, one process with CPAP_THREADS threads
+#   gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5000 wsgi:application
+#
+# app.py's own __main__ is the development server (debug mode and reloader).
+# Settings come from the environment: CPAP_HOST, CPAP_PORT, CPAP_THREADS,
+# CPAP_LOG_LEVEL, CPAP_ACCESS_LOG_SAMPLE and CPAP_SLOW_REQUEST_MS.
+import logging
+import os
+import random
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+LOG_LEVEL = os.environ.get("CPAP_LOG_LEVEL", "INFO").upper()
+# Fraction of requests written to the access log; errors and slow requests always are
+ACCESS_LOG_SAMPLE = float(os.environ.get("CPAP_ACCESS_LOG_SAMPLE", "0.01"))
+SLOW_REQUEST_MS = float(os.environ.get("CPAP_SLOW_REQUEST_MS", "500"))
+HOST = os.environ.get("CPAP_HOST", "0.0.0.0")
+PORT = int(os.environ.get("CPAP_PORT", "5000"))
+# Keep at or below database.POOL_SIZE so every thread gets a warm pooled connection
+THREADS = int(os.environ.get("CPAP_THREADS", "8"))
+
+# Configure logging before app.py does, so its DEBUG default does not apply
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(process)d - %(levelname)s - %(message)s')
+
+import app as records_app
+import sync_worker
+
+access_logger = logging.getLogger("access")
+
+
+# Logs a sample of requests with their status and total time, including the time
+# spent streaming the body
+class SampledAccessLog:
+    def __init__(self, wsgi_app, sample_rate=ACCESS_LOG_SAMPLE, slow_ms=SLOW_REQUEST_MS):
+        self.wsgi_app = wsgi_app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status = []
+
+        def log_start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+
+        def log_request():
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            code = int(status[0].split(" ", 1)[0]) if status else 500
+            if code >= 500 or elapsed_ms >= self.slow_ms or random.random() < self.sample_rate:
+                path = environ.get("PATH_INFO", "")
+                if environ.get("QUERY_STRING"):
+                    path += "?" + environ["QUERY_STRING"]
+                access_logger.info(
+                    f'{environ.get("REMOTE_ADDR", "-")} "{environ.get("REQUEST_METHOD")} {path}" {code} {elapsed_ms:.1f}ms'
+                )
+
+        return ClosingIterator(self.wsgi_app(environ, log_start_response), [log_request])
+
+
+# Bring the schema up to date and resume queued sends. The JSON snapshot is not
+# rebuilt here; the first request that needs it builds it.
+records_app.init_db()
+sync_worker.worker.start()
+
+application = SampledAccessLog(records_app.app)
+
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("waitress is not installed: pip install waitress (or run under gunicorn)")
+    logging.getLogger(__name__).info(f"Serving on {HOST}:{PORT} with {THREADS} threads")
+    serve(application, host=HOST, port=PORT, threads=THREADS, ident=None)